@@ -0,0 +1,206 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from pathlib import Path
+
+import conversation
+import message_history
+import providers
+
+# This provides an optional long-running `ask --serve` process. It keeps the
+# provider clients (and with them their HTTP keep-alive connection pools) and the
+# history store open between invocations. The CLI forwards each request over a
+# Unix socket and streams the response back, one JSON object per line:
+#   {"text": ...} for each chunk, {"usage": ...} with the provider-reported token
+#   counts, then {"done": true} or {"error": ...}
+
+SOCKET_FILENAME = "ask.sock"
+
+
+def socket_path(pathname=message_history.PATHNAME_MESSAGE_HISTORY):
+    return Path(pathname).expanduser() / SOCKET_FILENAME
+
+
+class DaemonError(Exception):
+    pass
+
+
+class AskDaemon:
+    def __init__(self):
+        self.store = message_history.open_store()
+        self.clients = {}
+        # The history store is shared by all connections
+        self.lock = threading.Lock()
+
+    def get_client(self, provider, model_name):
+        key = (provider, model_name)
+        if key not in self.clients:
+            self.clients[key] = providers.get_client(provider, model_name)
+        return self.clients[key]
+
+    def handle(self, request, wfile):
+        model_name = request["model_name"]
+        with self.lock:
+            try:
+                current_history, reply_index = conversation.load_history(
+                    self.store,
+                    request["reply_mode"],
+                    request["conv_id"],
+                    request["system_prompt"],
+                    model_name,
+                    request["from_turn"],
+                )
+            except IndexError:
+                _send(wfile, {"error": "Can't reply to empty history."})
+                return
+            except ValueError as e:
+                _send(wfile, {"error": str(e)})
+                return
+            # The store caches the conversation for every connection; a copy keeps
+            # this prompt out of other requests, and out of history if it is private
+            # or fails
+            current_history = current_history.with_message_history(
+                list(current_history.message_history)
+            )
+        current_history.append_user_message(
+            request["user_prompt"], request["attachments"]
+        )
+        usage = {}
+        completion, _ = conversation.start_completion(
+            current_history,
+            model_name,
+            request["optional_args"],
+            usage,
+            self.get_client,
+            context_strategy=request["context_strategy"],
+            max_context=request["max_context"],
+            use_cache=request["cache"],
+            refresh=request["refresh"],
+            retries=request["retries"],
+            fallback_model_name=request["fallback_model_name"],
+            hedge_after=request["hedge_after"],
+        )
+        turn_journal = None
+        if not request["private"]:
+            turn_journal = conversation.open_journal(
+                current_history, reply_index, model_name
+            )
+            completion = turn_journal.record(completion)
+
+        chunks = []
+        try:
+            for text in completion:
+                chunks.append(text)
+                _send(wfile, {"text": text})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client was interrupted; keep what was streamed so far, like the CLI does
+            pass
+        except Exception as e:
+            # Nothing is saved, as when the CLI reports the error itself
+            if turn_journal is not None:
+                turn_journal.discard()
+            _send(wfile, {"error": f"{type(e).__name__}: {e}"})
+            return
+        finally:
+            completion.close()
+
+        if not request["private"]:
+            with self.lock:
+                conversation.save_turn(
+                    self.store,
+                    current_history,
+                    reply_index,
+                    request["user_prompt"],
+                    "".join(chunks),
+                    usage.get("model", model_name),
+                    usage.get("attempts"),
+                )
+                self.store.flush()
+            turn_journal.discard()
+
+        try:
+            # Times by this process's clock mean nothing to the client
+            usage.pop("request_sent", None)
+            _send(wfile, {"usage": usage})
+            _send(wfile, {"done": True})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def _send(wfile, message):
+    wfile.write((json.dumps(message) + "\n").encode())
+    wfile.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        self.server.ask_daemon.handle(request, self.wfile)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path=None):
+    path = socket_path() if path is None else path
+    if path.exists():
+        sock = connect(path)
+        if sock is not None:
+            sock.close()
+            print(f"An ask daemon is already listening on {path}")
+            return 1
+        # Left behind by a daemon that didn't shut down cleanly
+        path.unlink()
+
+    # Opening the history store also creates ~/.gpt_cli if needed
+    daemon = AskDaemon()
+    server = _Server(str(path), _RequestHandler)
+    server.ask_daemon = daemon
+    os.chmod(path, 0o600)
+    print(f"ask daemon listening on {path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+    return 0
+
+
+def connect(path=None):
+    """
+    Return a socket connected to the daemon, or None if no daemon is running.
+    """
+    path = socket_path() if path is None else path
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    return sock
+
+
+def forward(sock, request, usage=None):
+    """
+    Send the request to the daemon and yield the response text in chunks. If a
+    usage dict is given, the token usage reported by the daemon is stored in it.
+    """
+    with sock, sock.makefile("rb") as rfile:
+        sock.sendall((json.dumps(request) + "\n").encode())
+        for line in rfile:
+            message = json.loads(line)
+            if "text" in message:
+                yield message["text"]
+            elif "usage" in message:
+                if usage is not None:
+                    usage.update(message["usage"])
+            elif "error" in message:
+                raise DaemonError(message["error"])
+            else:
+                return
+        raise DaemonError("ask daemon closed the connection mid-response")
@@ -0,0 +1,183 @@
+import glob
+import hashlib
+import mmap
+import os
+import stat
+import sys
+from pathlib import Path
+
+# This provides the files attached to prompts with -f. Each file's text is stored
+# once in ~/.gpt_cli/attachments/, named by its SHA-256, and messages refer to it
+# by that hash (see History.append_user_message), so attaching the same file to
+# many conversations stores it only once. Files are read through mmap and
+# checked for binary content before anything is decoded or stored. Text piped
+# into ask is attached the same way, as a file called <stdin>.
+
+ATTACHMENTS_PATHNAME = "~/.gpt_cli/attachments/"
+MAX_FILE_BYTES = 2 * 1024 * 1024
+MAX_TOTAL_BYTES = 8 * 1024 * 1024
+
+# A NUL byte this early means the file isn't text
+BINARY_SNIFF_BYTES = 8192
+
+STDIN_NAME = "<stdin>"
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_texts = {}  # hash -> text, for attachments already read in this process
+
+
+class AttachmentError(Exception):
+    pass
+
+
+def expand_paths(patterns):
+    """
+    Return the files named by patterns (paths or globs, ** included), in order
+    and without duplicates. Raises AttachmentError for a pattern matching nothing.
+    """
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(os.path.expanduser(pattern), recursive=True))
+        else:
+            matches = [os.path.expanduser(pattern)]
+        matches = [match for match in matches if os.path.isfile(match)]
+        if not matches:
+            raise AttachmentError(f"{pattern}: no such file")
+        paths.extend(match for match in matches if match not in paths)
+    return paths
+
+
+def _entry_path(sha256, pathname=ATTACHMENTS_PATHNAME):
+    return Path(pathname).expanduser() / sha256[:2] / sha256
+
+
+def _store(path, pathname=ATTACHMENTS_PATHNAME):
+    """
+    Store the file's text under its hash and return the hash, or None if the file
+    is binary.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap can't map an empty file
+            return _store_bytes(memoryview(b""), pathname)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped.find(b"\0", 0, BINARY_SNIFF_BYTES) != -1:
+                return None
+            with memoryview(mapped) as data:
+                return _store_bytes(data, pathname)
+
+
+def _store_bytes(data, pathname):
+    try:
+        text = str(data, "utf-8")
+    except UnicodeDecodeError:
+        return None
+    sha256 = hashlib.sha256(data).hexdigest()
+    _texts[sha256] = text
+    entry = _entry_path(sha256, pathname)
+    if not entry.exists():
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry.with_name(f"{sha256}.tmp{os.getpid()}")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, entry)
+    return sha256
+
+
+def attach(patterns, pathname=ATTACHMENTS_PATHNAME):
+    """
+    Store the files named by patterns and return (attachments, skipped):
+    references to put in a message, and the paths of binary files left out.
+    Raises AttachmentError if a pattern matches nothing or a size cap is exceeded.
+    """
+    paths = expand_paths(patterns)
+    total = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        if size > MAX_FILE_BYTES:
+            raise AttachmentError(
+                f"{path} is {size} bytes, more than the {MAX_FILE_BYTES} allowed per file"
+            )
+        total += size
+    if total > MAX_TOTAL_BYTES:
+        raise AttachmentError(
+            f"attachments total {total} bytes, more than the {MAX_TOTAL_BYTES} allowed"
+        )
+
+    attachments = []
+    skipped = []
+    for path in paths:
+        sha256 = _store(path, pathname)
+        if sha256 is None:
+            skipped.append(path)
+        else:
+            attachments.append({"name": path, "sha256": sha256})
+    return attachments, skipped
+
+
+def piped_stdin():
+    """
+    Return stdin as a binary stream if something is piped or redirected into it,
+    otherwise None (a terminal, /dev/null, or no stdin at all).
+    """
+    try:
+        mode = os.fstat(sys.stdin.fileno()).st_mode
+    except (AttributeError, OSError, ValueError):
+        return None
+    if stat.S_ISFIFO(mode) or stat.S_ISREG(mode):
+        return sys.stdin.buffer
+    return None
+
+
+def attach_stream(f, name=STDIN_NAME, pathname=ATTACHMENTS_PATHNAME):
+    """
+    Store the text read from binary stream f (e.g. piped stdin) like an attached
+    file called name, and return its reference (None if the stream is empty).
+    The stream is read in chunks, and reading stops as soon as it exceeds the
+    per-file cap. Raises AttachmentError if it is too long or isn't text.
+    """
+    data = bytearray()
+    while True:
+        chunk = f.read(STREAM_CHUNK_BYTES)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_FILE_BYTES:
+            raise AttachmentError(
+                f"{name} is more than the {MAX_FILE_BYTES} bytes allowed per file"
+            )
+    if not data:
+        return None
+    if data.find(b"\0", 0, BINARY_SNIFF_BYTES) != -1:
+        raise AttachmentError(f"{name} is binary")
+    with memoryview(data) as view:
+        sha256 = _store_bytes(view, pathname)
+    if sha256 is None:
+        raise AttachmentError(f"{name} isn't UTF-8 text")
+    return {"name": name, "sha256": sha256}
+
+
+def load_text(sha256, pathname=ATTACHMENTS_PATHNAME):
+    """
+    Return the stored text with this hash, or None if it isn't in the store.
+    """
+    if sha256 not in _texts:
+        try:
+            _texts[sha256] = _entry_path(sha256, pathname).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+    return _texts[sha256]
+
+
+def render(attachments, pathname=ATTACHMENTS_PATHNAME):
+    """
+    Return the attached files as they are appended to the prompt they belong to.
+    """
+    parts = []
+    for attachment in attachments:
+        text = load_text(attachment["sha256"], pathname)
+        if text is None:
+            text = f"[{attachment['name']} is missing from {pathname}]"
+        parts.append(f"\n\n--- {attachment['name']} ---\n{text}")
+    return "".join(parts)
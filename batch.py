@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import conversation
+import failover
+import message_history
+import providers
+import response_cache
+from model_handling import (
+    extract_model_name,
+    model_name_to_provider,
+    uses_legacy_completions,
+)
+
+# This provides `ask --batch`: run a JSONL file of prompts concurrently.
+#
+# Each input line is an object with a "prompt" and optionally an "id" (default:
+# line number), "model" (any name accepted by -m), "system" and "temperature".
+# Each output line repeats the id, model and prompt with a "response", or an
+# "error" if the request failed. Lines are written as prompts complete, and a
+# rerun skips every id that already has a response in the output file.
+
+# Requests per minute started against each provider, unless overridden with --rpm
+DEFAULT_REQUESTS_PER_MINUTE = {
+    "openai": 500,
+    "anthropic": 50,
+    "google": 150,
+    "xai": 60,
+    # Bounded by --concurrency rather than by a rate limit
+    "local": 6000,
+}
+
+
+class RateLimiter:
+    """
+    Spaces out request starts so that at most requests_per_minute begin per minute.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60 / requests_per_minute
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+
+def read_prompts(in_path):
+    prompts = []
+    with open(in_path) as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", line_number)
+            prompts.append(item)
+    return prompts
+
+
+def completed_ids(out_path):
+    """
+    Ids that already have a response in the output file.
+    """
+    if not Path(out_path).exists():
+        return set()
+    done = set()
+    with open(out_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if "response" in result:
+                done.add(result["id"])
+    return done
+
+
+def run_batch(
+    in_path,
+    out_path,
+    default_model_name,
+    system_prompt,
+    concurrency,
+    requests_per_minute=None,
+    private=False,
+    use_cache=False,
+    refresh=False,
+    retries=failover.DEFAULT_RETRIES,
+):
+    prompts = read_prompts(in_path)
+    done = completed_ids(out_path)
+    todo = [item for item in prompts if item["id"] not in done]
+    print(f"{len(prompts) - len(todo)} of {len(prompts)} prompts already done")
+
+    limiters = {
+        provider: RateLimiter(
+            requests_per_minute if requests_per_minute is not None else rpm
+        )
+        for provider, rpm in DEFAULT_REQUESTS_PER_MINUTE.items()
+    }
+    clients = {}
+    lock = threading.Lock()  # guards clients, the output file and the history store
+    store = None if private else message_history.open_store()
+
+    def run(item, out_file):
+        result = {"id": item["id"], "prompt": item["prompt"]}
+        try:
+            model_name = extract_model_name(item.get("model", default_model_name))
+            result["model"] = model_name
+            provider = model_name_to_provider(model_name)
+            with lock:
+                if model_name not in clients:
+                    clients[model_name] = providers.get_client(provider, model_name)
+            current_history = message_history.History(
+                None,
+                item.get("system", system_prompt),
+                legacy=uses_legacy_completions(model_name),
+            )
+            current_history.append_user_message(item["prompt"])
+            optional_args = (
+                {"temperature": item["temperature"]} if "temperature" in item else {}
+            )
+
+            def make_completion():
+                # Each retry waits its turn with the rate limiter too
+                def attempt(model_name, usage):
+                    limiters[provider].wait()
+                    return providers.stream_response(
+                        clients[model_name],
+                        provider,
+                        model_name,
+                        current_history,
+                        optional_args,
+                        usage,
+                    )
+
+                return failover.resilient_completion(
+                    attempt, model_name, {}, retries=retries
+                )
+
+            if use_cache:
+                completion = response_cache.cached_completion(
+                    model_name,
+                    provider,
+                    current_history,
+                    optional_args,
+                    make_completion,
+                    refresh=refresh,
+                )
+            else:
+                completion = make_completion()
+            result["response"] = "".join(completion)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        with lock:
+            out_file.write(json.dumps(result) + "\n")
+            out_file.flush()
+            if store is not None and "response" in result:
+                conversation.save_turn(
+                    store,
+                    current_history,
+                    None,
+                    item["prompt"],
+                    result["response"],
+                    model_name,
+                )
+        status = "error" if "error" in result else "done"
+        print(f"{item['id']}: {status}", flush=True)
+
+    with open(out_path, "a") as out_file:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for item in todo:
+                executor.submit(run, item, out_file)
+            executor.shutdown(wait=True)
+        except KeyboardInterrupt:
+            # Prompts already in flight still finish and get written
+            print("<KeyboardInterrupt>", flush=True)
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# End-to-end cost of one `ask` invocation per provider, against the local mock
+# server: wall time of the whole process minus the time the (simulated) model
+# itself takes to stream its response. That remainder is the CLI's overhead:
+# interpreter startup, imports, client setup, rendering and saving history.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mock_servers import MockServer
+
+GPT_CLI = Path(__file__).resolve().parent.parent / "gpt_cli.py"
+
+# One model per protocol the mock server speaks
+BENCH_MODELS = ["c", "41", "g", "base"]
+
+
+def time_invocation(env, model, extra_args):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(GPT_CLI), "-m", model, *extra_args, "benchmark prompt"],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=BENCH_MODELS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=1000.0)
+    parser.add_argument("--response-tokens", type=int, default=200)
+    parser.add_argument(
+        "--private",
+        action="store_true",
+        help="Pass -p, leaving saving history out of the measurement.",
+    )
+    args = parser.parse_args()
+
+    server = MockServer(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+    ).start()
+    model_time = server.expected_time()
+    extra_args = ["-p"] if args.private else []
+
+    print(f"simulated model time: {1000 * model_time:.0f} ms per request")
+    print(f"{'model':>8} {'min (ms)':>10} {'median (ms)':>12} {'overhead (ms)':>14}")
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, **server.environment(), "HOME": home}
+        for model in args.models:
+            times = [
+                time_invocation(env, model, extra_args) for _ in range(args.repeat)
+            ]
+            print(
+                f"{model:>8} {1000 * min(times):>10.0f} "
+                f"{1000 * statistics.median(times):>12.0f} "
+                f"{1000 * (min(times) - model_time):>14.0f}"
+            )
+    server.shutdown()
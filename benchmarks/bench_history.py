@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Per-invocation cost of the history calls one `ask` makes, against history size.
+# Compares the SQLite HistoryStore with the old load-the-whole-pickle approach.
+
+import argparse
+import pickle
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import message_history  # noqa: E402
+
+TURN_TEXT = "lorem ipsum dolor sit amet " * 40  # ~1 KB per message
+
+
+def make_history(chat_name, turns, turn_text=TURN_TEXT):
+    history = message_history.History(chat_name, "system prompt", legacy=False)
+    for _ in range(turns):
+        history.append_user_message(turn_text)
+        history.append_response(turn_text, "bench-model")
+    return history
+
+
+def populate(pathname, n_conversations, turns, turn_text=TURN_TEXT):
+    store = message_history.HistoryStore(pathname)
+    for i in range(n_conversations):
+        store.append_history(make_history(str(i), turns, turn_text))
+    store.close()
+
+
+def time_store_reply(pathname):
+    """Calls made by `ask "..." -r`: one store, one conversation read, one write."""
+    start = time.perf_counter()
+    store = message_history.HistoryStore(pathname)
+    history = store.get_history(-1)
+    history.append_user_message("prompt")
+    store.update_history(-1, "prompt", "response", "bench-model")
+    store.close()
+    return time.perf_counter() - start
+
+
+def time_store_new(pathname):
+    """Calls made by `ask "..."`: one append, which allots the new ID."""
+    start = time.perf_counter()
+    store = message_history.HistoryStore(pathname)
+    store.append_history(make_history(None, 1))
+    store.close()
+    return time.perf_counter() - start
+
+
+def time_pickle(path, n_conversations, turns, turn_text=TURN_TEXT):
+    """The old module: four full unpickles and one full rewrite per call."""
+    with open(path, "wb") as f:
+        pickle.dump(
+            {
+                "chat_names": [str(i) for i in range(n_conversations)],
+                "history_list": [
+                    make_history(str(i), turns, turn_text)
+                    for i in range(n_conversations)
+                ],
+            },
+            f,
+        )
+    start = time.perf_counter()
+    for _ in range(4):
+        with open(path, "rb") as f:
+            d = pickle.load(f)
+    d["history_list"][-1].append_user_message("prompt")
+    with open(path, "wb") as f:
+        pickle.dump(d, f)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Numbers of conversations to benchmark.",
+    )
+    parser.add_argument("--turns", type=int, default=3, help="Turns per conversation.")
+    parser.add_argument(
+        "--message-chars",
+        type=int,
+        default=len(TURN_TEXT),
+        help="Length of every saved message.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs per measurement (best is kept)."
+    )
+    parser.add_argument(
+        "--skip-pickle", action="store_true", help="Don't time the old pickle format."
+    )
+    args = parser.parse_args()
+    turn_text = (TURN_TEXT * (args.message_chars // len(TURN_TEXT) + 1))[
+        : args.message_chars
+    ]
+
+    print(
+        f"{'conversations':>13} {'ask (ms)':>10} {'ask -r (ms)':>12} {'pickle (ms)':>12}"
+    )
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as pathname:
+            populate(pathname, size, args.turns, turn_text)
+            new_ms = 1000 * min(time_store_new(pathname) for _ in range(args.repeat))
+            reply_ms = 1000 * min(
+                time_store_reply(pathname) for _ in range(args.repeat)
+            )
+            if args.skip_pickle:
+                pickle_ms = float("nan")
+            else:
+                pickle_ms = 1000 * time_pickle(
+                    Path(pathname) / "bench.pkl", size, args.turns, turn_text
+                )
+        print(f"{size:>13} {new_ms:>10.2f} {reply_ms:>12.2f} {pickle_ms:>12.2f}")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Cost of building provider payloads for a long conversation, as `ask -r` (or the
+# daemon) does once per turn, and memory per message. Compares History, whose
+# per-platform views are extended as messages are appended, with rebuilding every
+# payload from plain dicts, as History did before.
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import message_history  # noqa: E402
+
+TURN_TEXT = "lorem ipsum dolor sit amet " * 8
+PLATFORMS = ["openai", "anthropic", "google", "legacy"]
+
+
+def rebuild_from_dicts(lines, platform):
+    """The payload as it used to be built: from scratch, on every call."""
+    if platform == "legacy":
+        prompt = ""
+        for line in lines:
+            prompt += line["content"]
+        return prompt
+    elif platform == "google":
+        return [
+            {
+                "role": "model" if line["role"] == "assistant" else line["role"],
+                "parts": [{"text": line["content"]}],
+            }
+            for line in lines[1:]
+        ]
+    else:
+        return [{"role": line["role"], "content": line["content"]} for line in lines]
+
+
+def make_history(turns):
+    history = message_history.History("0", "system prompt", legacy=False)
+    for i in range(turns):
+        history.append_user_message(f"{i} {TURN_TEXT}")
+        history.append_response(f"{i} {TURN_TEXT}", "bench-model")
+    return history
+
+
+def time_turns(turns, calls, platform):
+    """
+    Time `calls` more turns of a `turns`-turn conversation, each appending a
+    message pair and building the payload. Returns (incremental, rebuilt) seconds.
+    """
+    history = make_history(turns)
+    history.get_message_history(platform)  # views exist from earlier turns
+    lines = [
+        {"role": line.role, "content": line.content, "model_name": line.model_name}
+        for line in history.get_message_history()
+    ]
+
+    start = time.perf_counter()
+    for i in range(calls):
+        history.append_user_message(TURN_TEXT)
+        history.append_response(TURN_TEXT, "bench-model")
+        history.get_message_history(platform)
+    incremental = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(calls):
+        lines.append({"role": "user", "content": TURN_TEXT})
+        lines.append(
+            {"role": "assistant", "content": TURN_TEXT, "model_name": "bench-model"}
+        )
+        rebuild_from_dicts(lines, platform)
+    rebuilt = time.perf_counter() - start
+    return incremental, rebuilt
+
+
+def memory_per_message(turns):
+    """Bytes per message for Message objects and for the dicts they replace."""
+    contents = [f"{i} {TURN_TEXT}" for i in range(2 * turns)]
+    model_name = "-".join(["bench", "model"])  # not a literal, so not pre-interned
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = [
+        message_history.Message("assistant", content, "".join(model_name))
+        for content in contents
+    ]
+    message_bytes = tracemalloc.get_traced_memory()[0] - before
+    del messages
+
+    before = tracemalloc.get_traced_memory()[0]
+    dicts = [
+        {"role": "assistant", "content": content, "model_name": "".join(model_name)}
+        for content in contents
+    ]
+    dict_bytes = tracemalloc.get_traced_memory()[0] - before
+    del dicts
+    tracemalloc.stop()
+    return message_bytes / len(contents), dict_bytes / len(contents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--turns", type=int, default=10000, help="Turns already in the conversation."
+    )
+    parser.add_argument(
+        "--calls", type=int, default=20, help="Further turns to time, per platform."
+    )
+    args = parser.parse_args()
+
+    print(f"{args.turns}-turn conversation, {args.calls} further turns")
+    print(f"{'platform':>10} {'views (ms/turn)':>16} {'rebuilt (ms/turn)':>18}")
+    for platform in PLATFORMS:
+        incremental, rebuilt = time_turns(args.turns, args.calls, platform)
+        print(
+            f"{platform:>10} {1000 * incremental / args.calls:>16.3f} "
+            f"{1000 * rebuilt / args.calls:>18.3f}"
+        )
+
+    start = time.perf_counter()
+    make_history(args.turns)
+    print(f"building the conversation: {1000 * (time.perf_counter() - start):.1f} ms")
+    message_bytes, dict_bytes = memory_per_message(args.turns)
+    print(
+        f"bytes per message (excluding content): Message {message_bytes:.0f}, "
+        f"dict {dict_bytes:.0f}"
+    )
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Cost of --recall against an index of many saved turns: the top-k search over
+# the memory-mapped matrix that every `ask --recall K` pays, and the append
+# that every saved turn pays once the index exists.
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import recall  # noqa: E402
+
+VOCABULARY_SIZE = 20000
+WORDS_PER_TURN = 150
+
+
+def make_words(rng):
+    return [
+        "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))
+        )
+        for _ in range(VOCABULARY_SIZE)
+    ]
+
+
+def make_text(rng, words):
+    return " ".join(rng.choices(words, k=WORDS_PER_TURN))
+
+
+def populate(pathname, n_turns, rng, words):
+    """
+    Write an index of n_turns turns, one per conversation, as build_index would.
+    """
+    directory = Path(pathname)
+    vectors = array("f")
+    rows = array("i")
+    for conv_id in range(n_turns):
+        vectors.extend(recall.vectorize(make_text(rng, words)))
+        rows.extend([conv_id, 1])
+    with open(directory / recall.VECTORS_FILENAME, "wb") as f:
+        vectors.tofile(f)
+    with open(directory / recall.ROWS_FILENAME, "wb") as f:
+        rows.tofile(f)
+
+
+def percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(p / 100 * len(times)))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 50000],
+        help="Numbers of indexed turns to benchmark.",
+    )
+    parser.add_argument("--k", type=int, default=5, help="Turns recalled per search.")
+    parser.add_argument(
+        "--queries", type=int, default=50, help="Searches timed per size."
+    )
+    args = parser.parse_args()
+
+    # Loads the first search would otherwise pay for
+    import numpy  # noqa: E402, F401
+
+    rng = random.Random(0)
+    words = make_words(rng)
+    print(
+        f"{'turns':>8} {'index (MB)':>11} {'search p50 (ms)':>16}"
+        f" {'search p95 (ms)':>16} {'append (ms)':>12}"
+    )
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as pathname:
+            populate(pathname, size, rng, words)
+            index_mb = size * recall.VECTOR_BYTES / 2**20
+
+            search_times = []
+            for _ in range(args.queries):
+                query = make_text(rng, words)[:200]
+                start = time.perf_counter()
+                recall.search(query, args.k, pathname)
+                search_times.append(time.perf_counter() - start)
+
+            append_times = []
+            for conv_id in range(size, size + 20):
+                text = make_text(rng, words)
+                start = time.perf_counter()
+                recall.index_turn(conv_id, 1, text, pathname)
+                append_times.append(time.perf_counter() - start)
+
+        print(
+            f"{size:>8} {index_mb:>11.1f} {1000 * percentile(search_times, 50):>16.2f}"
+            f" {1000 * percentile(search_times, 95):>16.2f}"
+            f" {1000 * percentile(append_times, 50):>12.2f}"
+        )
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Throughput of the streaming markdown renderer against the size of the chunks a
+# provider sends, rendering to an in-memory terminal.
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rich.console import Console  # noqa: E402
+
+from rendering import MarkdownStream  # noqa: E402
+
+SECTION = """## Section {i}
+
+Some prose with **bold**, `inline code` and a [link](https://example.com), long
+enough to wrap at least once on an ordinary terminal width of a hundred columns.
+
+- first item
+- second item with more words in it
+  1. nested ordered item
+
+```python
+def f(x):
+    return x * {i}
+```
+
+| a | b |
+|---|---|
+| {i} | {i} |
+
+"""
+
+
+def make_document(sections):
+    return "".join(SECTION.format(i=i) for i in range(sections))
+
+
+def time_rendering(document, chunk_size):
+    console = Console(file=io.StringIO(), force_terminal=True, width=100)
+    chunks = [document[i : i + chunk_size] for i in range(0, len(document), chunk_size)]
+    start = time.perf_counter()
+    with MarkdownStream(console=console) as markdown_stream:
+        for text in chunks:
+            markdown_stream.feed(text)
+    return time.perf_counter() - start, len(chunks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--chunk-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 64, 256],
+        help="Characters per streamed chunk.",
+    )
+    parser.add_argument(
+        "--sections", type=int, default=50, help="Length of the rendered document."
+    )
+    args = parser.parse_args()
+
+    document = make_document(args.sections)
+    print(f"document: {len(document)} characters")
+    print(
+        f"{'chunk size':>10} {'total (ms)':>11} {'per chunk (us)':>15} {'chars/s':>10}"
+    )
+    for chunk_size in args.chunk_sizes:
+        seconds, n_chunks = time_rendering(document, chunk_size)
+        print(
+            f"{chunk_size:>10} {1000 * seconds:>11.1f} "
+            f"{1e6 * seconds / n_chunks:>15.1f} {len(document) / seconds:>10.0f}"
+        )
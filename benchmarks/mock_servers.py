@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the provider APIs, for benchmarking and trying out the CLI
+# without API keys. One server speaks all three streaming protocols:
+#   POST /v1/chat/completions and /v1/completions   OpenAI (and xAI) SSE
+#   POST /v1/messages                               Anthropic messages stream
+#   POST /v1beta/models/<model>:streamGenerateContent   Gemini SSE
+# Responses are made of whitespace-separated words, one per "token", sent at a
+# configurable rate after a configurable time to first token. Point the CLI at it
+# with the base URL environment variables printed on startup (see providers.py).
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LATENCY = 0.2
+DEFAULT_TOKENS_PER_SECOND = 100.0
+DEFAULT_RESPONSE_TOKENS = 200
+
+# Placeholder keys, so the SDKs don't refuse to start without real ones
+MOCK_API_KEYS = {
+    "ANTHROPIC_API_KEY": "mock",
+    "GOOGLE_API_KEY": "mock",
+    "OPENAI_API_KEY_CLI": "mock",
+    "XAI_API_KEY": "mock",
+}
+
+
+def _estimate_tokens(body):
+    # ~4 bytes per token, as in model_handling.estimate_token_count
+    return (len(body) + 3) // 4
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # One response per connection; the stream ends when the connection closes
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request = json.loads(body or b"{}")
+        input_tokens = _estimate_tokens(body)
+        path = self.path.split("?")[0]
+
+        if path.endswith("/chat/completions"):
+            if request.get("stream"):
+                self._stream_openai(request, input_tokens, chat=True)
+            else:
+                self._complete_openai(request, input_tokens)
+        elif path.endswith("/completions"):
+            self._stream_openai(request, input_tokens, chat=False)
+        elif path.endswith("/messages"):
+            self._stream_anthropic(request, input_tokens)
+        elif path.endswith(":streamGenerateContent"):
+            model_name = path.rsplit("/", 1)[-1].split(":")[0]
+            self._stream_google(model_name, input_tokens)
+        else:
+            self.send_error(404, f"mock server doesn't serve {path}")
+
+    def _texts(self):
+        """
+        Yield the response in chunks, paced like a model generating it.
+        """
+        config = self.server.config
+        start = time.perf_counter() + config["latency"]
+        n_tokens = config["response_tokens"]
+        step = config["chunk_tokens"]
+        for i in range(0, n_tokens, step):
+            # Scheduled against the start, so pacing doesn't drift
+            delay = start + i / config["tokens_per_second"] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield "".join(f"word{j} " for j in range(i, min(i + step, n_tokens)))
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _event(self, data, event=None):
+        message = f"data: {json.dumps(data)}\n\n"
+        if event is not None:
+            message = f"event: {event}\n{message}"
+        self.wfile.write(message.encode())
+        self.wfile.flush()
+
+    def _stream_openai(self, request, input_tokens, chat):
+        model_name = request.get("model", "mock")
+        self._start_stream()
+        for text in self._texts():
+            if chat:
+                choice = {"index": 0, "delta": {"content": text}, "finish_reason": None}
+            else:
+                choice = {"index": 0, "text": text, "finish_reason": None}
+            self._event(
+                {
+                    "id": "mock",
+                    "object": "chat.completion.chunk" if chat else "text_completion",
+                    "created": int(time.time()),
+                    "model": model_name,
+                    "choices": [choice],
+                }
+            )
+        if request.get("stream_options", {}).get("include_usage"):
+            output_tokens = self.server.config["response_tokens"]
+            self._event(
+                {
+                    "id": "mock",
+                    "object": "chat.completion.chunk" if chat else "text_completion",
+                    "created": int(time.time()),
+                    "model": model_name,
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": input_tokens,
+                        "completion_tokens": output_tokens,
+                        "total_tokens": input_tokens + output_tokens,
+                    },
+                }
+            )
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _complete_openai(self, request, input_tokens):
+        output_tokens = self.server.config["response_tokens"]
+        response = json.dumps(
+            {
+                "id": "mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": "".join(self._texts()),
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": input_tokens,
+                    "completion_tokens": output_tokens,
+                    "total_tokens": input_tokens + output_tokens,
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def _stream_anthropic(self, request, input_tokens):
+        self._start_stream()
+        self._event(
+            {
+                "type": "message_start",
+                "message": {
+                    "id": "mock",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request.get("model", "mock"),
+                    "content": [],
+                    "stop_reason": None,
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+                },
+            },
+            "message_start",
+        )
+        self._event(
+            {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": {"type": "text", "text": ""},
+            },
+            "content_block_start",
+        )
+        for text in self._texts():
+            self._event(
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": "text_delta", "text": text},
+                },
+                "content_block_delta",
+            )
+        self._event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self._event(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": self.server.config["response_tokens"]},
+            },
+            "message_delta",
+        )
+        self._event({"type": "message_stop"}, "message_stop")
+
+    def _stream_google(self, model_name, input_tokens):
+        self._start_stream()
+        output_tokens = 0
+        for text in self._texts():
+            output_tokens += len(text.split())
+            self._event(
+                {
+                    "candidates": [
+                        {
+                            "content": {"parts": [{"text": text}], "role": "model"},
+                            "index": 0,
+                        }
+                    ],
+                    "usageMetadata": {
+                        "promptTokenCount": input_tokens,
+                        "candidatesTokenCount": output_tokens,
+                        "totalTokenCount": input_tokens + output_tokens,
+                    },
+                    "modelVersion": model_name,
+                }
+            )
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=DEFAULT_LATENCY,
+        tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+        response_tokens=DEFAULT_RESPONSE_TOKENS,
+        chunk_tokens=1,
+    ):
+        super().__init__((host, port), _Handler)
+        self.config = {
+            "latency": latency,
+            "tokens_per_second": tokens_per_second,
+            "response_tokens": response_tokens,
+            "chunk_tokens": chunk_tokens,
+        }
+
+    def expected_time(self):
+        """
+        How long a full response takes to stream, excluding any client overhead.
+        """
+        config = self.config
+        last_chunk = config["response_tokens"] - 1
+        last_chunk -= last_chunk % config["chunk_tokens"]
+        return config["latency"] + last_chunk / config["tokens_per_second"]
+
+    def environment(self):
+        """
+        Environment variables that point the CLI (see providers.py) at this server.
+        """
+        host, port = self.server_address[:2]
+        url = f"http://{host}:{port}"
+        return {
+            **MOCK_API_KEYS,
+            "ANTHROPIC_BASE_URL": url,
+            "GOOGLE_BASE_URL": url,
+            "OPENAI_BASE_URL": f"{url}/v1",
+            "XAI_BASE_URL": f"{url}/v1",
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=DEFAULT_LATENCY,
+        help="Seconds before the first token.",
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=DEFAULT_TOKENS_PER_SECOND
+    )
+    parser.add_argument(
+        "--response-tokens",
+        type=int,
+        default=DEFAULT_RESPONSE_TOKENS,
+        help="Length of every response, in tokens (words).",
+    )
+    parser.add_argument(
+        "--chunk-tokens", type=int, default=1, help="Tokens per streamed event."
+    )
+    args = parser.parse_args()
+
+    server = MockServer(
+        port=args.port,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        chunk_tokens=args.chunk_tokens,
+    )
+    for name, value in server.environment().items():
+        print(f"export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
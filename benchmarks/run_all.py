@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+# Run every benchmark with its default settings, one after another. To change
+# a benchmark's settings, run its script directly (each takes --help).
+
+import subprocess
+import sys
+from pathlib import Path
+
+BENCHMARKS = [
+    ("CLI overhead against the mock provider server", "bench_cli.py"),
+    ("Rendering throughput per chunk size", "bench_rendering.py"),
+    ("History load/save per invocation", "bench_history.py"),
+    ("Payload building and memory per message", "bench_messages.py"),
+    ("Concurrent history writers", "stress_history.py"),
+    ("--recall search and index update", "bench_recall.py"),
+]
+
+if __name__ == "__main__":
+    failed = []
+    for title, script in BENCHMARKS:
+        print(f"== {title} ({script})", flush=True)
+        result = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve().parent / script)]
+        )
+        if result.returncode != 0:
+            failed.append(script)
+        print(flush=True)
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+    exit(1 if failed else 0)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# Many `ask` invocations saving turns to one history at once: each writer process
+# opens its own store per turn, like separate invocations do, and either starts a
+# new conversation or replies to a shared one. Afterwards every turn must be in
+# the history exactly once, with its response right after it, and conversation
+# IDs must run 0, 1, 2, ... with each conversation named by its ID.
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import conversation  # noqa: E402
+import message_history  # noqa: E402
+
+SHARED_CONV_ID = 0
+MODEL_NAME = "stress-model"
+
+
+def prompt_text(writer, turn):
+    return f"writer {writer} turn {turn}"
+
+
+def response_text(writer, turn):
+    return f"response to writer {writer} turn {turn}"
+
+
+def is_reply(writer, turn):
+    return (writer + turn) % 2 == 0
+
+
+def write_turns(home, writer, turns, start):
+    # The history and the request log are under ~/.gpt_cli
+    os.environ["HOME"] = home
+    start.wait()
+    for turn in range(turns):
+        store = message_history.HistoryStore()
+        reply = is_reply(writer, turn)
+        try:
+            current_history, reply_index = conversation.load_history(
+                store,
+                reply,
+                SHARED_CONV_ID if reply else None,
+                "system prompt",
+                MODEL_NAME,
+            )
+            current_history.append_user_message(prompt_text(writer, turn))
+            conversation.save_turn(
+                store,
+                current_history,
+                reply_index,
+                prompt_text(writer, turn),
+                response_text(writer, turn),
+                MODEL_NAME,
+            )
+            store.close()
+        except Exception as e:
+            # Like a failed invocation: this turn is lost, the next one goes ahead
+            print(f"writer {writer} turn {turn}: {type(e).__name__}: {e}", flush=True)
+
+
+def check(writers, turns):
+    """
+    Return a list of what is wrong with the history the writers left behind.
+    """
+    conn = sqlite3.connect(
+        Path(message_history.PATHNAME_MESSAGE_HISTORY).expanduser()
+        / message_history.FILENAME_HISTORY_DB
+    )
+    problems = []
+
+    conversations = conn.execute(
+        "SELECT id, chat_name FROM conversations ORDER BY id"
+    ).fetchall()
+    expected_conversations = 1 + sum(
+        not is_reply(writer, turn) for writer in range(writers) for turn in range(turns)
+    )
+    if len(conversations) != expected_conversations:
+        problems.append(
+            f"{len(conversations)} conversations, expected {expected_conversations}"
+        )
+    for position, (conv_id, chat_name) in enumerate(conversations):
+        if conv_id != position or chat_name != str(conv_id):
+            problems.append(f"conversation {conv_id} named {chat_name!r} at {position}")
+            break
+
+    messages = {}
+    for conv_id, rows in _by_conversation(
+        conn.execute(
+            "SELECT conversation_id, role, content FROM messages ORDER BY conversation_id, id"
+        )
+    ):
+        messages[conv_id] = rows
+    for writer in range(writers):
+        for turn in range(turns):
+            prompt = prompt_text(writer, turn)
+            found = [
+                (conv_id, index)
+                for conv_id, rows in messages.items()
+                for index, row in enumerate(rows)
+                if row == ("user", prompt)
+            ]
+            if len(found) != 1:
+                problems.append(f"{prompt!r} saved {len(found)} times")
+                continue
+            conv_id, index = found[0]
+            if (conv_id == SHARED_CONV_ID) != is_reply(writer, turn):
+                problems.append(f"{prompt!r} saved in conversation {conv_id}")
+            following = messages[conv_id][index + 1 : index + 2]
+            if following != [("assistant", response_text(writer, turn))]:
+                problems.append(f"{prompt!r} not followed by its response")
+    conn.close()
+    return problems
+
+
+def _by_conversation(rows):
+    current_id = None
+    current = []
+    for conv_id, role, content in rows:
+        if conv_id != current_id:
+            if current_id is not None:
+                yield current_id, current
+            current_id, current = conv_id, []
+        current.append((role, content))
+    if current_id is not None:
+        yield current_id, current
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["HOME"] = home
+        store = message_history.HistoryStore()
+        store.append_history(
+            message_history.History("0", "system prompt", legacy=False)
+        )
+        store.close()
+
+        start = multiprocessing.Event()
+        processes = [
+            multiprocessing.Process(
+                target=write_turns, args=(home, writer, args.turns, start)
+            )
+            for writer in range(args.writers)
+        ]
+        for process in processes:
+            process.start()
+        started = time.perf_counter()
+        start.set()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        crashed = sum(process.exitcode != 0 for process in processes)
+        problems = check(args.writers, args.turns)
+
+    total = args.writers * args.turns
+    print(
+        f"{args.writers} writers x {args.turns} turns: {total} turns in {elapsed:.2f} s"
+        f" ({total / elapsed:.0f} turns/s)"
+    )
+    if crashed:
+        problems.insert(0, f"{crashed} writers crashed")
+    for problem in problems[:20]:
+        print(f"  {problem}")
+    if len(problems) > 20:
+        print(f"  ... and {len(problems) - 20} more")
+    print("FAIL" if problems else "OK: no turns lost")
+    exit(1 if problems else 0)
@@ -0,0 +1,294 @@
+import time
+
+import failover
+import journal
+import message_history
+import providers
+import recall
+import request_log
+import response_cache
+import token_budget
+from model_handling import (
+    MODEL_NAME_TO_PROVIDER,
+    model_name_to_provider,
+    uses_legacy_completions,
+)
+
+# This provides the history bookkeeping around one turn of a conversation,
+# shared by the CLI and the ask daemon.
+
+# Providers that carry on from a response left at the end of the conversation
+# sent to them (a "prefill"); the others are asked to continue in a new message
+PREFILL_PROVIDERS = ("anthropic",)
+CONTINUE_PROMPT = "Your previous response was cut off. Continue it exactly where it stopped, without repeating anything and without any preamble."
+
+
+def load_history(store, reply_mode, conv_id, system_prompt, model_name, from_turn=None):
+    """
+    Return (current_history, reply_index): the conversation being replied to (the
+    most recent one unless conv_id is given), or a new one with reply_index None.
+    With from_turn, the reply goes to a new branch of the conversation after
+    that turn (also with reply_index None), unless that is its last turn.
+    Raises IndexError if there is no such conversation, and ValueError if it has
+    fewer than from_turn turns.
+    """
+    if reply_mode:
+        # If conv_id specified, reply to that, otherwise reply to most recent conversation
+        # (looked up once: by the time the turn is saved, other processes may have
+        # saved newer ones)
+        reply_index = store.resolve_index(conv_id if conv_id is not None else -1)
+        current_history = store.get_history(reply_index)
+        if from_turn is None or from_turn == current_history.count_turns():
+            return current_history, reply_index
+        branch = store.branch(reply_index, current_history.turn_boundary(from_turn))
+        return branch, None
+    else:
+        # Named by its ID once saved (see HistoryStore.append_history)
+        current_history = message_history.History(
+            None,
+            system_prompt,
+            legacy=uses_legacy_completions(model_name),
+        )
+        return current_history, None
+
+
+def start_completion(
+    current_history,
+    model_name,
+    optional_args,
+    usage,
+    get_client,
+    context_strategy="drop_oldest",
+    max_context=None,
+    use_cache=False,
+    refresh=False,
+    retries=failover.DEFAULT_RETRIES,
+    fallback_model_name=None,
+    hedge_after=None,
+):
+    """
+    Return (completion, dropped): the response stream to current_history, and how
+    many messages were left out to fit model_name's context window. Requests are
+    retried and hedged as in failover.py; get_client(provider, model_name)
+    supplies the clients, and the model that answered ends up in usage["model"].
+    """
+    # What is sent may be trimmed to fit the context window; what is saved isn't
+    send_histories = {
+        model_name: token_budget.fit_to_context(
+            current_history, model_name, context_strategy, max_context
+        )
+    }
+    dropped = len(current_history.get_message_history()) - len(
+        send_histories[model_name].get_message_history()
+    )
+
+    def make_completion(attempt_model_name, attempt_usage):
+        provider = model_name_to_provider(attempt_model_name)
+        if attempt_model_name not in send_histories:
+            # The fallback's context window may differ
+            send_histories[attempt_model_name] = token_budget.fit_to_context(
+                current_history, attempt_model_name, context_strategy, max_context
+            )
+        send_history = send_histories[attempt_model_name]
+
+        def stream():
+            return providers.stream_response(
+                get_client(provider, attempt_model_name),
+                provider,
+                attempt_model_name,
+                send_history,
+                optional_args,
+                attempt_usage,
+            )
+
+        if use_cache:
+            # On a cache hit, the provider SDK isn't even imported
+            return response_cache.cached_completion(
+                attempt_model_name,
+                provider,
+                send_history,
+                optional_args,
+                stream,
+                refresh=refresh,
+                usage=attempt_usage,
+            )
+        return stream()
+
+    completion = failover.resilient_completion(
+        make_completion,
+        model_name,
+        usage,
+        retries=retries,
+        fallback_model_name=fallback_model_name,
+        hedge_after=hedge_after,
+    )
+    return completion, dropped
+
+
+def save_turn(
+    store,
+    current_history,
+    reply_index,
+    user_prompt,
+    response,
+    model_name,
+    attempts=None,
+):
+    """
+    Record the turn in the history store, the log and the --recall index, and add the response to
+    current_history. model_name is the model that answered; attempts, if given,
+    are the requests made for it (see failover.py) and go in the log. Returns the
+    conversation's ID, which later turns can pass as reply_index.
+    """
+    # Whatever was attached to the prompt is saved by reference
+    attached = current_history.get_message_history()[-1].attachments
+    # Add GPT's response to current_history object
+    current_history.append_response(response, model_name)
+    if reply_index is not None:
+        conv_id = store.update_history(
+            reply_index, user_prompt, response, model_name, attached
+        )
+    else:
+        # Save current_history object to message history, which names it by its ID
+        conv_id = store.append_history(current_history)
+
+    record = {
+        "time": time.time(),
+        "conversation": current_history.get_chat_name(),
+        "model": model_name,
+        "prompt": user_prompt,
+        "attachments": attached,
+        "response": response,
+    }
+    if attempts:
+        record["attempts"] = attempts
+    request_log.log_request(record)
+    recall.index_turn(
+        conv_id, current_history.count_turns(), recall.turn_text(user_prompt, response)
+    )
+    return conv_id
+
+
+def continuation(current_history, model_name):
+    """
+    Return (history to send, prefix) for continuing the response that ends
+    current_history with model_name (`ask --continue`): the continued response
+    is prefix followed by what the model sends. Raises ValueError if
+    current_history doesn't end with a response.
+    """
+    lines = current_history.get_message_history()
+    if not lines or lines[-1].role != "assistant":
+        raise ValueError(
+            f"Conversation {current_history.get_chat_name()} doesn't end with a response to continue."
+        )
+    partial = lines[-1]
+    if not partial.content.strip():
+        # Nothing to continue from: ask again
+        return current_history.with_message_history(lines[:-1]), ""
+    if uses_legacy_completions(model_name):
+        # The prompt is plain text, which already ends with the response so far
+        return current_history, partial.content
+    if model_name_to_provider(model_name) in PREFILL_PROVIDERS:
+        # Anthropic rejects a prefill that ends with whitespace
+        prefix = partial.content.rstrip()
+        prefill = message_history.Message("assistant", prefix, partial.model_name)
+        return current_history.with_message_history(lines[:-1] + [prefill]), prefix
+    history = current_history.with_message_history(list(lines))
+    history.append_user_message(CONTINUE_PROMPT)
+    return history, partial.content
+
+
+def continuing_model(current_history, model_name):
+    """
+    Return the model that wrote the response that ends current_history, to
+    continue it with, or model_name if it isn't known (any more).
+    """
+    lines = current_history.get_message_history()
+    if lines and lines[-1].model_name in MODEL_NAME_TO_PROVIDER:
+        return lines[-1].model_name
+    return model_name
+
+
+def save_continuation(store, current_history, reply_index, response, model_name):
+    """
+    Replace the response that ends conversation reply_index (loaded as
+    current_history) with response, its continued version by model_name, in
+    the history store and the --recall index. Returns the conversation's ID.
+    """
+    conv_id = store.update_response(reply_index, response, model_name)
+    lines = current_history.get_message_history()
+    user_prompt = lines[-2].content if len(lines) > 1 else ""
+    recall.index_turn(
+        conv_id, current_history.count_turns(), recall.turn_text(user_prompt, response)
+    )
+    return conv_id
+
+
+def open_journal(current_history, reply_index, model_name, prefix=None):
+    """
+    Return a journal.Journal for the response about to be streamed, with what is
+    needed to save it if this process dies first: the turn whose prompt ends
+    current_history, or with prefix, the continuation of the response that ends it.
+    """
+    if prefix is not None:
+        return journal.Journal(
+            {"reply_index": reply_index, "prefix": prefix, "model_name": model_name}
+        )
+    lines = current_history.get_message_history()
+    return journal.Journal(
+        {
+            "reply_index": reply_index,
+            "fork": current_history.fork,
+            "legacy": current_history.is_legacy(),
+            "system_prompt": lines[0].content if lines[0].role == "system" else None,
+            "user_prompt": lines[-1].content,
+            "attachments": lines[-1].attachments,
+            "model_name": model_name,
+        }
+    )
+
+
+def recover_interrupted(store):
+    """
+    Save what journals left behind by processes that died while streaming a
+    response recorded (see journal.py), and return the IDs of the conversations
+    saved to. Journals for conversations that no longer exist are dropped.
+    """
+    conv_ids = []
+    for header, response in journal.recover():
+        reply_index = header["reply_index"]
+        try:
+            if "prefix" in header:
+                conv_id = save_continuation(
+                    store,
+                    store.get_history(reply_index),
+                    reply_index,
+                    header["prefix"] + response,
+                    header["model_name"],
+                )
+            else:
+                if reply_index is not None:
+                    current_history = store.get_history(reply_index)
+                elif header["fork"] is not None:
+                    current_history = store.branch(*header["fork"])
+                else:
+                    current_history = message_history.History(
+                        None, header["system_prompt"], legacy=header["legacy"]
+                    )
+                current_history.append_user_message(
+                    header["user_prompt"], header["attachments"]
+                )
+                conv_id = save_turn(
+                    store,
+                    current_history,
+                    reply_index,
+                    header["user_prompt"],
+                    response,
+                    header["model_name"],
+                )
+        except IndexError:
+            continue
+        # Committed before the journal is deleted (when the next one is asked for)
+        store.flush()
+        conv_ids.append(conv_id)
+    return conv_ids
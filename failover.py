@@ -0,0 +1,239 @@
+import queue
+import random
+import sys
+import threading
+import time
+
+# This provides retrying and hedging of requests, for when a provider is slow to
+# start answering or overloaded. Failed requests are retried with exponential
+# backoff and full jitter, as long as no text has arrived yet. If they still fail,
+# the request goes to a fallback model instead. If hedging is on and the first
+# text takes longer than hedge_after seconds, the fallback is asked as well;
+# whichever stream starts first is used, and the other is abandoned. Every attempt is recorded in usage["attempts"], and the model that
+# answered in usage["model"].
+
+DEFAULT_RETRIES = 2
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 16.0
+
+# Rate limits, timeouts, server errors and Anthropic's 529 "overloaded"
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def is_retryable(e):
+    # openai and anthropic errors carry status_code, google-genai ones code
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    # Dropped connections and timeouts, which google-genai raises straight from
+    # httpx (only looked up if a provider SDK has already imported it)
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(
+        e, (httpx.NetworkError, httpx.TimeoutException, httpx.RemoteProtocolError)
+    ):
+        return True
+    # Connection errors and timeouts, named alike in all the SDKs
+    name = type(e).__name__
+    return "Connect" in name or "Timeout" in name or "Overloaded" in name
+
+
+def backoff_delay(retry):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**retry))
+
+
+def _describe(e):
+    return f"{type(e).__name__}: {e}"
+
+
+def retrying(make_completion, model_name, usage, retries, attempts, start, stop=None):
+    """
+    Yield the response from make_completion(model_name, usage), starting over
+    after a retryable error as long as nothing has been yielded yet. Each try is
+    appended to attempts. Stops early once stop (a threading.Event) is set.
+    """
+    for retry in range(retries + 1):
+        attempt = {"model": model_name, "started": time.perf_counter() - start}
+        attempts.append(attempt)
+        completion = None
+        started = False
+        try:
+            completion = make_completion(model_name, usage)
+            for text in completion:
+                if not started:
+                    started = True
+                    attempt["first_text"] = time.perf_counter() - start
+                yield text
+                if stop is not None and stop.is_set():
+                    attempt["outcome"] = "cancelled"
+                    return
+            attempt["outcome"] = "done"
+            return
+        except GeneratorExit:
+            attempt["outcome"] = "interrupted"
+            raise
+        except Exception as e:
+            attempt["outcome"] = _describe(e)
+            if started or retry == retries or not is_retryable(e):
+                raise
+        finally:
+            if completion is not None:
+                completion.close()
+        delay = backoff_delay(retry)
+        if stop is not None:
+            if stop.wait(delay):
+                return
+        else:
+            time.sleep(delay)
+
+
+def _race(make_completion, model_name, usage, retries, attempts, start, events, stop):
+    # Runs on its own thread, passing what it streams to the main thread
+    try:
+        for text in retrying(
+            make_completion, model_name, usage, retries, attempts, start, stop
+        ):
+            events.put((model_name, "text", text))
+        events.put((model_name, "done", None))
+    except Exception as e:
+        events.put((model_name, "error", e))
+
+
+def hedged(
+    make_completion, model_name, fallback_model_name, hedge_after, retries, usage
+):
+    """
+    Yield the response of model_name, or of fallback_model_name if model_name
+    hasn't started answering within hedge_after seconds and the fallback starts
+    first. Each model's request is retried on its own.
+    """
+    start = time.perf_counter()
+    attempts = usage.setdefault("attempts", [])
+    events = queue.Queue()
+    racers = {}
+
+    def launch(name):
+        racer_usage = {}
+        stop = threading.Event()
+        racers[name] = (racer_usage, stop)
+        threading.Thread(
+            target=_race,
+            args=(
+                make_completion,
+                name,
+                racer_usage,
+                retries,
+                attempts,
+                start,
+                events,
+                stop,
+            ),
+            daemon=True,
+        ).start()
+
+    launch(model_name)
+    winner = None
+    failed = set()
+    try:
+        while True:
+            if winner is None and fallback_model_name not in racers:
+                timeout = max(0, hedge_after - (time.perf_counter() - start))
+            else:
+                timeout = None
+            try:
+                name, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                launch(fallback_model_name)
+                continue
+
+            if winner is None:
+                if kind == "error":
+                    failed.add(name)
+                    # Fail over to the other model, or give up if it failed too
+                    if fallback_model_name not in racers:
+                        launch(fallback_model_name)
+                    elif len(failed) == len(racers):
+                        raise value
+                    continue
+                # The first model to send anything (even an empty response) wins
+                winner = name
+                # Timed from the first request, as without hedging
+                if "request_sent" in racers[model_name][0]:
+                    usage["request_sent"] = racers[model_name][0]["request_sent"]
+                for other, (_, stop) in racers.items():
+                    if other != winner:
+                        stop.set()
+            if name != winner:
+                continue
+
+            if kind == "text":
+                yield value
+            elif kind == "done":
+                break
+            else:
+                raise value
+    finally:
+        for _, stop in racers.values():
+            stop.set()
+        for attempt in attempts:
+            # Still waiting for its first text when the race was decided
+            attempt.setdefault("outcome", "cancelled")
+        if winner is not None:
+            usage.update(racers[winner][0])
+            usage["model"] = winner
+
+
+def failing_over(make_completion, model_name, fallback_model_name, retries, usage):
+    """
+    Yield the response of model_name, or of fallback_model_name if model_name
+    fails (after its retries) before sending anything.
+    """
+    start = time.perf_counter()
+    attempts = usage.setdefault("attempts", [])
+    usage["model"] = model_name
+    started = False
+    try:
+        for text in retrying(
+            make_completion, model_name, usage, retries, attempts, start
+        ):
+            started = True
+            yield text
+        return
+    except Exception:
+        if started:
+            raise
+    usage["model"] = fallback_model_name
+    yield from retrying(
+        make_completion, fallback_model_name, usage, retries, attempts, start
+    )
+
+
+def resilient_completion(
+    make_completion,
+    model_name,
+    usage,
+    retries=DEFAULT_RETRIES,
+    fallback_model_name=None,
+    hedge_after=None,
+):
+    """
+    Return the response stream for model_name from make_completion(model_name,
+    usage), retried, failed over to fallback_model_name if given (and hedged, if
+    hedge_after is set too) as described at the top of this module.
+    """
+    if fallback_model_name is not None and hedge_after is None:
+        return failing_over(
+            make_completion, model_name, fallback_model_name, retries, usage
+        )
+    if fallback_model_name is None:
+        usage["model"] = model_name
+        return retrying(
+            make_completion,
+            model_name,
+            usage,
+            retries,
+            usage.setdefault("attempts", []),
+            time.perf_counter(),
+        )
+    return hedged(
+        make_completion, model_name, fallback_model_name, hedge_after, retries, usage
+    )
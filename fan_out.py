@@ -0,0 +1,115 @@
+import threading
+from contextlib import closing
+
+import conversation
+import failover
+import metrics
+import providers
+from model_handling import model_name_to_provider
+
+# This provides sending one prompt to several models at once (`-m c,5,g`).
+# Each model streams on its own thread and gets its own conversation in history.
+
+
+def load_histories(
+    store, model_names, reply_mode, conv_id, system_prompt, from_turn=None
+):
+    """
+    Return (histories, reply_index), histories mapping each model name to the
+    History to send it. When replying, every model gets its own branch of the
+    conversation (sharing its messages so far), saved as a new conversation later.
+    Raises IndexError if there is no conversation to reply to, and ValueError
+    if it has fewer than from_turn turns.
+    """
+    histories = {}
+    for model_name in model_names:
+        current_history, reply_index = conversation.load_history(
+            store, reply_mode, conv_id, system_prompt, model_name, from_turn
+        )
+        if reply_index is not None:
+            # Each model gets a branch at the end, rather than the conversation itself
+            current_history = store.branch(
+                reply_index, len(current_history.message_history)
+            )
+        histories[model_name] = current_history
+    return histories, reply_index
+
+
+def stream_all(
+    histories, optional_args, chunks, errors, retries=failover.DEFAULT_RETRIES
+):
+    """
+    Stream each model's response into chunks[model_name] concurrently, recording
+    exceptions in errors[model_name]. Returns once every stream has finished.
+    Failed requests are retried, but not hedged: every model is already asked.
+    """
+    stop = threading.Event()
+
+    def run(model_name):
+        provider = model_name_to_provider(model_name)
+        usage = {}
+        record = {}
+        try:
+            completion = metrics.timed(
+                failover.resilient_completion(
+                    lambda model_name, usage: providers.stream_response(
+                        providers.get_client(provider, model_name),
+                        provider,
+                        model_name,
+                        histories[model_name],
+                        optional_args,
+                        usage,
+                    ),
+                    model_name,
+                    usage,
+                    retries=retries,
+                ),
+                record,
+                usage,
+            )
+            with closing(completion):
+                for text in completion:
+                    chunks[model_name].append(text)
+                    if stop.is_set():
+                        break
+        except Exception as e:
+            errors[model_name] = f"{type(e).__name__}: {e}"
+            return
+        metrics.log_metrics(
+            metrics.finish_record(
+                record, model_name, provider, usage, interrupted=stop.is_set()
+            )
+        )
+
+    # Daemon threads, so an interrupted run doesn't wait for the slowest stream
+    threads = [
+        threading.Thread(target=run, args=(model_name,), daemon=True)
+        for model_name in histories
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+
+
+def save_branches(store, histories, user_prompt, responses):
+    """
+    Save each model's turn as its own conversation and return their chat names.
+    """
+    chat_names = {}
+    for model_name, current_history in histories.items():
+        if model_name not in responses:
+            continue
+        conversation.save_turn(
+            store,
+            current_history,
+            None,
+            user_prompt,
+            responses[model_name],
+            model_name,
+        )
+        chat_names[model_name] = current_history.get_chat_name()
+    return chat_names
@@ -1,25 +1,32 @@
 #!/usr/bin/env python3
 
 import os
-from openai import OpenAI
-import anthropic
-from google import genai
-from google.genai import types
+import sys
 import argparse
-from datetime import datetime
+import contextlib
 import subprocess
-from rich.console import Console
-from rich.markdown import Markdown
-from rich.live import Live
+import time
+from datetime import datetime
 
+import ask_daemon
+import attachments
+import batch
+import conversation
+import failover
+import fan_out
+import journal
 import message_history
+import metrics
+import model_handling
+import providers
+import recall
+import response_cache
+import token_budget
 from model_handling import (
-    MODEL_NAME_TO_ABBREV,
     extract_model_name,
+    get_fallback_model,
     lacks_streaming_support,
-    MODEL_NAME_TO_ABBREV_LEGEND,
     model_name_to_provider,
-    DEFAULT_MODEL_NAME,
     uses_legacy_completions,
 )
 
@@ -27,8 +34,65 @@ DEFAULT_SYSTEM_PROMPT = """Your task is to provide high-quality thoughtful respo
 
 DEFAULT_FILENAME = "LLM_ATTACHED_CONTEXT.txt"
 
+# Modules that must only be imported once a command actually needs them
+LAZY_MODULES = ["openai", "anthropic", "google.genai", "rich"]
+
+
+def startup_bench():
+    """
+    Measure the import cost every invocation pays (via python -X importtime), and
+    report failure if any of LAZY_MODULES gets imported at startup.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import gpt_cli"],
+        cwd=os.path.dirname(os.path.realpath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    # Lines look like "import time:  self [us] |  cumulative | imported package",
+    # with nested imports indented under the module that imported them
+    top_level = []
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imported.add(name.strip())
+        if not name[1:].startswith(" "):
+            top_level.append((int(cumulative), name.strip()))
+
+    total_us = sum(cumulative for cumulative, _ in top_level)
+    print(f"Total startup import time: {total_us / 1000:.1f} ms")
+    for cumulative, name in sorted(top_level, reverse=True)[:10]:
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        print(f"Error: imported at startup but should be lazy: {', '.join(eager)}")
+        return 1
+    return 0
+
+
+def parse_since(since):
+    """
+    Turn "YYYY-MM-DD[THH:MM]" or "<N>h"/"<N>d" (N hours/days ago) into a Unix time.
+    """
+    if since is None:
+        return None
+    if since[-1] in "hd" and since[:-1].isdigit():
+        hours = int(since[:-1]) * (24 if since[-1] == "d" else 1)
+        return time.time() - hours * 3600
+    return datetime.fromisoformat(since).timestamp()
+
 
 if __name__ == "__main__":
+    # Models from ~/.gpt_cli/models.toml, needed for the -m help and default
+    try:
+        model_handling.load_models_config()
+    except model_handling.ModelConfigError as e:
+        print(f"Error: {e}")
+        exit(1)
+
     # Parse command line input
 
     # Set up parser
@@ -58,9 +122,8 @@ if __name__ == "__main__":
         "-m",
         "--model",
         nargs="?",
-        default=DEFAULT_MODEL_NAME,
         type=str,
-        help=f"Model to use: {MODEL_NAME_TO_ABBREV_LEGEND}",
+        help=f"Model to use, or a comma-separated list to ask several at once (default {model_handling.DEFAULT_MODEL_NAME}; with --continue, the model that wrote the response): {model_handling.model_abbrev_legend()}",
     )
     parser.add_argument(
         "-c",
@@ -76,11 +139,41 @@ if __name__ == "__main__":
         type=str,
         help=f'System prompt to use. Default: "{DEFAULT_SYSTEM_PROMPT}"',
     )
+    parser.add_argument(
+        "--from-turn",
+        type=int,
+        metavar="K",
+        help="Reply to a conversation (with -c, or the most recent) from after its turn K, as a new branch; the turns after K stay as they were. K=0 keeps only the system prompt.",
+    )
+    parser.add_argument(
+        "--continue",
+        dest="continue_response",
+        action="store_true",
+        help="Continue the response that ends a conversation (with -c, or the most recent), e.g. one cut off by Ctrl-C or a crash, instead of asking something new.",
+    )
+    parser.add_argument(
+        "--tree",
+        action="store_true",
+        help="With -d, show a conversation's branches as a tree (with -c), or every conversation that has branches.",
+    )
+    parser.add_argument(
+        "--recall",
+        type=int,
+        metavar="K",
+        help="Attach the K earlier turns most similar to the prompt, from any conversation.",
+    )
+    parser.add_argument(
+        "-i",
+        "--interactive",
+        action="store_true",
+        help="Start a multi-turn session (with -r, continuing a conversation); /help lists its commands.",
+    )
     parser.add_argument(
         "-f",
         "--fileread",
-        action="store_true",
-        help=f"If selected, appends to prompt content from {DEFAULT_FILENAME}",
+        nargs="*",
+        metavar="PATH",
+        help=f"Attach files to the prompt: paths or globs (e.g. 'src/**/*.py'), or {DEFAULT_FILENAME} if none are given.",
     )
     parser.add_argument(
         "-w",
@@ -92,27 +185,187 @@ if __name__ == "__main__":
     parser.add_argument(
         "-t", "--temperature", help="Set the temperature for the query.", type=float
     )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Write the response to stdout as it arrives, without markdown rendering (the default when stdout isn't a terminal).",
+    )
+    parser.add_argument(
+        "--no-stdin",
+        action="store_true",
+        help="Don't read piped or redirected stdin (e.g. in a `while read` loop, or when stdin is a pipe that is never closed).",
+    )
+    parser.add_argument(
+        "--search",
+        type=str,
+        help="Search all conversations and list the best matches with their IDs.",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="Max number of conversations to list: the most recent ones for -d, the best matches for --search (default: all of them for -d, 10 for --search).",
+    )
+    parser.add_argument(
+        "--offset",
+        type=int,
+        default=0,
+        help="With -d, skip this many of the most recent conversations.",
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        help="With -d or --stats, only include conversations/requests since a date (YYYY-MM-DD) or a time ago (e.g. 12h, 7d).",
+    )
+    parser.add_argument(
+        "--context-strategy",
+        choices=token_budget.CONTEXT_STRATEGIES,
+        default="drop_oldest",
+        help="How to shorten a conversation that doesn't fit the context window (or --max-context): drop the oldest turns, replace them with a summary, or send everything.",
+    )
+    parser.add_argument(
+        "--max-context",
+        type=int,
+        help="Token budget for what is sent (default: the model's context window minus room for the response).",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"Reuse a cached response to an identical request, and cache new ones (also enabled by {response_cache.CACHE_ENV_VAR}=1).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't use the response cache, even if enabled in the environment.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="With the cache enabled, ask the model again and replace the cached response.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=failover.DEFAULT_RETRIES,
+        help="Times to retry a request that fails (rate limited, overloaded, ...) before any text arrives, with jittered exponential backoff.",
+    )
+    parser.add_argument(
+        "--hedge-after",
+        type=float,
+        metavar="SECONDS",
+        help="If no text has arrived after this long, also ask the fallback model, and use whichever answers first.",
+    )
+    parser.add_argument(
+        "--fallback",
+        type=str,
+        help="Model to ask if the model still fails after its retries, and that --hedge-after asks as well (default depends on the model).",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        help="Run every prompt in this JSONL file (see batch.py for the format); requires --out.",
+    )
+    parser.add_argument(
+        "--out", type=str, help="JSONL file that --batch appends results to."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Number of --batch prompts in flight at once.",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        help="Max --batch requests started per minute per provider (default depends on provider).",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a daemon that keeps provider clients and history loaded; later calls are forwarded to it.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Show latency and throughput percentiles per model (use --since to limit the window).",
+    )
+    parser.add_argument(
+        "--startup-bench",
+        action="store_true",
+        help="Report import time at startup and fail if a provider SDK or rich is imported eagerly.",
+    )
 
     # Parse and extract args
     args = parser.parse_args()
 
     user_prompt = args.prompt
-    reply_mode = args.reply
+    # Branching off a conversation, or continuing one, is a kind of reply
+    reply_mode = args.reply or args.from_turn is not None or args.continue_response
     display_mode = args.display
-    short_model_name = args.model
-    model_name = extract_model_name(short_model_name)
+    short_model_name = args.model or model_handling.DEFAULT_MODEL_NAME
+    model_names = [extract_model_name(name) for name in short_model_name.split(",")]
+    model_name = model_names[0]
     conv_id = args.conversation_id
     system_prompt = args.system
     fileread = args.fileread
     filewrite = args.filewrite
     temperature = args.temperature
+    # Escape codes and live redrawing are no use in a pipe or file
+    raw = args.raw or not sys.stdout.isatty()
+    use_cache = response_cache.is_enabled(args.cache, args.no_cache)
+    requested_fallback = (
+        extract_model_name(args.fallback) if args.fallback is not None else None
+    )
+    fallback_model_name = get_fallback_model(model_name, requested_fallback)
+
+    if args.startup_bench:
+        exit(startup_bench())
+
+    if args.serve:
+        exit(ask_daemon.serve())
+
+    if args.stats:
+        metrics.display_stats(parse_since(args.since))
+        exit(0)
+
+    # First handle display and search modes
+    if args.search is not None:
+        try:
+            message_history.search_history(
+                args.search, args.limit if args.limit is not None else 10
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit(1)
+        exit(0)
 
-    # First handle display mode
     if display_mode:
-        if conv_id is not None:
+        if args.tree:
+            message_history.display_tree(conv_id)
+        elif conv_id is not None:
             message_history.display_history(conv_id)
         else:
-            message_history.display_all_history()
+            message_history.display_all_history(
+                args.limit, args.offset, parse_since(args.since)
+            )
+        exit(0)
+
+    # Next handle batch mode
+    if args.batch is not None:
+        if args.out is None:
+            print("Error: --batch needs --out to write results to.")
+            exit(1)
+        batch.run_batch(
+            args.batch,
+            args.out,
+            short_model_name.split(",")[0],
+            system_prompt,
+            args.concurrency,
+            requests_per_minute=args.rpm,
+            private=args.private,
+            use_cache=use_cache,
+            refresh=args.refresh,
+            retries=args.retries,
+        )
         exit(0)
 
     # Next handle write mode
@@ -122,217 +375,362 @@ if __name__ == "__main__":
 
     # Otherwise enter conversation mode
 
-    if user_prompt is None:
-        parser.print_help()
+    # Responses a crash cut off last time are saved before anything else
+    if journal.pending():
+        for recovered_id in conversation.recover_interrupted(
+            message_history.open_store()
+        ):
+            print(
+                f"(saved an interrupted response in conversation {recovered_id}; `ask -c {recovered_id} --continue` resumes it)",
+                file=sys.stderr,
+            )
+
+    if args.continue_response and (
+        user_prompt is not None
+        or fileread is not None
+        or args.interactive
+        or args.from_turn is not None
+        or args.recall
+        or len(model_names) > 1
+    ):
+        print(
+            "Error: --continue takes no prompt, and doesn't go with -f, -i, --from-turn, --recall or several models."
+        )
         exit(1)
 
-    # If history list does not exist, create it
-    # (i.e. there is no message_history.pkl saved where you expect)
-    if not message_history.is_history_list():
-        message_history.init_history_list()
+    # `ask -f "prompt"` makes the prompt the last argument of -f
+    if user_prompt is None and fileread and not args.interactive:
+        user_prompt = fileread.pop()
 
-    chat_names = message_history.get_chat_names()
-    history_list = message_history.get_history_list()
+    # Text piped into ask is the prompt, or if a prompt is given, attached to it
+    # (`cat big.log | ask "summarize"`); in interactive mode, stdin is for input
+    piped = (
+        None
+        if args.interactive or args.continue_response or args.no_stdin
+        else attachments.piped_stdin()
+    )
+    if piped is not None and user_prompt is None:
+        user_prompt = piped.read().decode("utf-8", errors="replace").rstrip("\n")
+        user_prompt = user_prompt or None
+        piped = None
 
-    # Get current chat name and history
-    if reply_mode:
-        # If conv_id specified, reply to that, otherwise reply to most recent conversation
-        if conv_id is not None:
-            reply_index = conv_id
-        else:
-            reply_index = -1
-        try:
-            current_history = history_list[reply_index]
-            current_chat_name = current_history.get_chat_name()
-        except IndexError:
-            print("Can't reply to empty history.")
-    else:
-        current_chat_name = str(len(chat_names))
-        current_history = message_history.History(
-            current_chat_name,
-            system_prompt,
-            legacy=uses_legacy_completions(model_name),
-        )
+    if user_prompt is None and not args.interactive and not args.continue_response:
+        parser.print_help()
+        exit(1)
 
-    if fileread:
-        try:
-            with open(DEFAULT_FILENAME, "r") as f:
-                fileread_content = f.read()
-        except FileNotFoundError:
+    attached = []
+    if fileread is not None:
+        if not fileread and not os.path.exists(DEFAULT_FILENAME):
             print(
                 f"Error: {DEFAULT_FILENAME} not found. First run `gpt -w` to write to this file."
             )
             exit(1)
-        full_prompt = user_prompt + fileread_content
-    else:
-        full_prompt = user_prompt
+        try:
+            attached, skipped = attachments.attach(fileread or [DEFAULT_FILENAME])
+        except attachments.AttachmentError as e:
+            print(f"Error: {e}")
+            exit(1)
+        for path in skipped:
+            print(f"(skipped binary file {path})", file=sys.stderr)
+    if piped is not None:
+        try:
+            attachment = attachments.attach_stream(piped)
+        except attachments.AttachmentError as e:
+            print(f"Error: {e}")
+            exit(1)
+        if attachment is not None:
+            attached.append(attachment)
 
-    current_history.append_user_message(full_prompt)
+    # Earlier turns like this prompt (in interactive mode, the session does this per prompt)
+    if args.recall and not args.interactive:
+        recall_store = message_history.open_store()
+        in_context = None
+        if reply_mode:
+            try:
+                in_context = recall_store.get_history(
+                    conv_id if conv_id is not None else -1
+                )
+            except IndexError:
+                pass
+        recalled = recall.recall(recall_store, user_prompt, args.recall, in_context)
+        if recalled:
+            attached.append(recall.attach(recalled))
+            conv_ids = ", ".join(sorted({str(conv) for conv, *_ in recalled}, key=int))
+            print(
+                f"(recalled {len(recalled)} earlier turn{'s' if len(recalled) > 1 else ''}, from conversations {conv_ids})",
+                file=sys.stderr,
+            )
 
     optional_args = {"temperature": temperature} if temperature is not None else dict()
     # for some reason, this arg doesn't work for me yet
     # if is_reasoning_model(model_name):
     #     optional_args["reasoning_effort"] = "high"
 
-    # Talk to model
+    # Interactive mode: many turns in this process, starting with the prompt if given
 
-    provider = model_name_to_provider(model_name)
+    if args.interactive:
+        import repl
 
-    console = Console()  # for printing markdown
+        if len(model_names) > 1:
+            print("Interactive mode talks to one model at a time.")
+            exit(1)
 
-    if provider == "anthropic":
+        store = message_history.open_store()
         try:
-            client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
-            system_prompt, messages = current_history.get_message_history(
-                platform="anthropic"
+            current_history, reply_index = conversation.load_history(
+                store, reply_mode, conv_id, system_prompt, model_name, args.from_turn
             )
+        except IndexError:
+            print("Can't reply to empty history.")
+            exit(1)
+        except ValueError as e:
+            print(e)
+            exit(1)
 
-            if system_prompt is None:
-                messages_dict = {"messages": messages}
-            else:
-                messages_dict = {"system": system_prompt, "messages": messages}
-
-            response = ""
-            buffer = ""
-
-            with client.messages.stream(
-                model=model_name, max_tokens=4000, **messages_dict, **optional_args
-            ) as stream:
-                with Live(console=console, refresh_per_second=10) as live:
-                    for text in stream.text_stream:
-                        response += text
-                        live.update(Markdown(response))
-        except KeyboardInterrupt:
-            print("<KeyboardInterrupt>", flush=True)
-        else:
-            print()
+        session = repl.Session(
+            store,
+            current_history,
+            reply_index,
+            model_name,
+            optional_args,
+            private=args.private,
+            context_strategy=args.context_strategy,
+            max_context=args.max_context,
+            use_cache=use_cache,
+            refresh=args.refresh,
+            retries=args.retries,
+            fallback_model_name=requested_fallback,
+            hedge_after=args.hedge_after,
+            raw=raw,
+            recall=args.recall,
+        )
+        session.attached = attached
+        repl.run(session, user_prompt)
+        exit(0)
 
-    elif provider == "google":
-        try:
+    # With several models, ask them all at once and save each answer as its own conversation
+
+    if len(model_names) > 1:
+        store = message_history.open_store()
 
-            system_prompt, messages = current_history.get_message_history(
-                platform="google"
+        try:
+            histories, _ = fan_out.load_histories(
+                store, model_names, reply_mode, conv_id, system_prompt, args.from_turn
             )
+        except IndexError:
+            print("Can't reply to empty history.")
+            exit(1)
+        except ValueError as e:
+            print(e)
+            exit(1)
 
-            client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        for current_history in histories.values():
+            current_history.append_user_message(user_prompt, attached)
 
-            completion = client.models.generate_content_stream(
-                model=model_name,
-                contents=messages,
-            )
+        chunks = {model_name: [] for model_name in model_names}
+        errors = {}
 
-            response = ""
+        if raw:
+            display = contextlib.nullcontext()
+        else:
+            from rendering import FanOutDisplay
 
-            with Live(console=console, refresh_per_second=10) as live:
-                for chunk in completion:
-                    if chunk.text:
-                        response += chunk.text
-                    live.update(Markdown(response))
+            display = FanOutDisplay(chunks, errors)
 
+        try:
+            with display:
+                fan_out.stream_all(
+                    {
+                        model_name: token_budget.fit_to_context(
+                            current_history,
+                            model_name,
+                            args.context_strategy,
+                            args.max_context,
+                        )
+                        for model_name, current_history in histories.items()
+                    },
+                    optional_args,
+                    chunks,
+                    errors,
+                    retries=args.retries,
+                )
         except KeyboardInterrupt:
-            print("<KeyboardInterrupt>", flush=True)
+            print("<KeyboardInterrupt>", file=sys.stderr if raw else sys.stdout)
         else:
-            print()
+            if not raw:
+                print()
+
+        if raw:
+            # Each answer in full, one after another, once they have all finished
+            try:
+                for model_name in model_names:
+                    print(f"--- {model_name} ---")
+                    print("".join(chunks[model_name]))
+                    if model_name in errors:
+                        print(errors[model_name], file=sys.stderr)
+                # A reader that has gone shows up here rather than at exit
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # The answers are still saved
+                from raw_output import discard_output
+
+                discard_output(sys.stdout)
+
+        responses = {
+            model_name: "".join(chunks[model_name])
+            for model_name in model_names
+            if model_name not in errors or chunks[model_name]
+        }
+
+        if not args.private:
+            chat_names = fan_out.save_branches(store, histories, user_prompt, responses)
+            # Kept out of the answers, which may be going to a pipe
+            for model_name, chat_name in chat_names.items():
+                print(
+                    f"{model_name}: saved as conversation {chat_name}", file=sys.stderr
+                )
+        exit(0)
 
-    elif provider == "openai" or provider == "xai":
+    # Talk to model, through the daemon if one is running (continuing is done here)
 
-        base_url = "https://api.x.ai/v1" if provider == "xai" else None
-        if provider == "xai":
-            api_key = os.getenv("XAI_API_KEY")
-        else:
-            # first detect if there's a model-specific API key
-            model_abbrevs = MODEL_NAME_TO_ABBREV.get(model_name, [])
-            for model_abbrev in model_abbrevs:
-                env_var = f"OPENAI_API_KEY_{model_abbrev}"
-                if os.getenv(env_var):
-                    api_key = os.getenv(env_var)
-                    break
-            else:
-                api_key = os.getenv("OPENAI_API_KEY_CLI")
-
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
+    daemon_socket = None if args.continue_response else ask_daemon.connect()
+
+    provider = model_name_to_provider(model_name)
+    usage = {}
+
+    if daemon_socket is not None:
+        completion = ask_daemon.forward(
+            daemon_socket,
+            {
+                "user_prompt": user_prompt,
+                "attachments": attached,
+                "reply_mode": reply_mode,
+                "conv_id": conv_id,
+                "from_turn": args.from_turn,
+                "system_prompt": system_prompt,
+                "model_name": model_name,
+                "optional_args": optional_args,
+                "private": args.private,
+                "cache": use_cache,
+                "refresh": args.refresh,
+                "context_strategy": args.context_strategy,
+                "max_context": args.max_context,
+                "retries": args.retries,
+                "fallback_model_name": fallback_model_name,
+                "hedge_after": args.hedge_after,
+            },
+            usage,
         )
+    else:
+        # If history list does not exist, create it
+        # (i.e. there is no message_history.db saved where you expect)
+        if not message_history.is_history_list():
+            message_history.init_history_list()
 
-        try:
+        store = message_history.open_store()
 
-            if uses_legacy_completions(model_name):
-
-                prompt = current_history.get_message_history(platform="legacy")
-
-                completion = client.completions.create(
-                    model=model_name,
-                    prompt=prompt,
-                    stream=True,
-                    max_tokens=4000,
-                    **optional_args,
-                )  # type: ignore
-
-                response = ""
-                for chunk in completion:
-                    chunk_message_str = chunk.choices[0].text
-                    response += chunk_message_str
-                    print(chunk_message_str, end="", flush=True)
-
-            elif lacks_streaming_support(model_name):
-
-                completion = client.chat.completions.create(
-                    model=model_name,
-                    messages=current_history.get_message_history(platform="openai"),
-                    **optional_args,
-                )  # type: ignore
-
-                response = completion.choices[0].message.content
-                print(response)
-
-            else:
-                completion = client.chat.completions.create(
-                    model=model_name,
-                    messages=current_history.get_message_history(platform="openai"),
-                    stream=True,
-                    **optional_args,
-                )  # type: ignore
-
-                response = ""
-                with Live(console=console, refresh_per_second=10) as live:
-                    for chunk in completion:
-                        chunk_message = chunk.choices[0].delta
-                        chunk_message_str = (
-                            chunk_message.content
-                            if chunk_message.content is not None
-                            else ""
-                        )
-                        response += chunk_message_str
-                        live.update(Markdown(response))
+        # Get current history
+        try:
+            current_history, reply_index = conversation.load_history(
+                store, reply_mode, conv_id, system_prompt, model_name, args.from_turn
+            )
+        except IndexError:
+            print("Can't reply to empty history.")
+            exit(1)
+        except ValueError as e:
+            print(e)
+            exit(1)
 
-        except KeyboardInterrupt:
-            print("<KeyboardInterrupt>", flush=True)
+        if args.continue_response:
+            if args.model is None:
+                model_name = conversation.continuing_model(current_history, model_name)
+                provider = model_name_to_provider(model_name)
+            try:
+                sent_history, prefix = conversation.continuation(
+                    current_history, model_name
+                )
+            except ValueError as e:
+                print(e)
+                exit(1)
+            # A fallback model could only start over
+            fallback_model_name = None
         else:
-            print()
+            current_history.append_user_message(user_prompt, attached)
+            sent_history, prefix = current_history, None
+
+        completion, dropped = conversation.start_completion(
+            sent_history,
+            model_name,
+            optional_args,
+            usage,
+            providers.get_client,
+            context_strategy=args.context_strategy,
+            max_context=args.max_context,
+            use_cache=use_cache,
+            refresh=args.refresh,
+            retries=args.retries,
+            fallback_model_name=fallback_model_name,
+            hedge_after=args.hedge_after,
+        )
+        if dropped > 0:
+            print(
+                f"({dropped} earlier messages left out to fit the context window)",
+                file=sys.stderr,
+            )
 
-    # Log to history
-    if args.private:
-        pass
-    else:
-        if reply_mode:
-            message_history.update_history(
-                reply_index, user_prompt, response, model_name
+        # Kept until the turn is saved, so a crash loses none of the response
+        turn_journal = None
+        if not args.private:
+            turn_journal = conversation.open_journal(
+                current_history, reply_index, model_name, prefix
+            )
+            completion = turn_journal.record(completion)
+
+    record = {}
+    try:
+        if raw:
+            from raw_output import write_completion
+
+            response, interrupted = write_completion(
+                metrics.timed(completion, record, usage)
             )
         else:
-            # Add GPT's response to current_history object
-            current_history.append_response(response, model_name)
-            # Save current_history object to message history
-            message_history.append_history(current_history)
+            from rendering import render_completion
 
-        # Log all raw data
+            response, interrupted = render_completion(
+                metrics.timed(completion, record, usage),
+                plain=uses_legacy_completions(model_name)
+                or lacks_streaming_support(model_name),
+            )
+    except ask_daemon.DaemonError as e:
+        # What the daemon couldn't do, reported as the CLI would itself
+        print(e)
+        exit(1)
+    metrics.log_metrics(
+        metrics.finish_record(record, model_name, provider, usage, interrupted)
+    )
 
-        message_history.write_to_log(
-            f"time: {datetime.now().strftime('%Y-%m-%d-%H:%M:%S')}\n"
-        )
-        message_history.write_to_log(f"prompt: {user_prompt}\n")
-        message_history.write_to_log(f"model: {model_name}\n")
-        message_history.write_to_log(f"response: {response}\n\n")
-        if provider == "google":
-            message_history.write_to_log(str(completion) + "\n\n")
+    # A fallback model may have answered instead
+    answered_by = usage.get("model", model_name)
+    if answered_by != model_name:
+        print(f"(answered by {answered_by})", file=sys.stderr)
+
+    # Log to history (the daemon does this itself)
+    if daemon_socket is None and not args.private:
+        if prefix is not None:
+            conversation.save_continuation(
+                store, current_history, reply_index, prefix + response, answered_by
+            )
+        else:
+            conversation.save_turn(
+                store,
+                current_history,
+                reply_index,
+                user_prompt,
+                response,
+                answered_by,
+                usage.get("attempts"),
+            )
+        # Only once the response is in the database is the journal not needed
+        store.flush()
+        turn_journal.discard()
@@ -0,0 +1,106 @@
+import fcntl
+import json
+import os
+import time
+from pathlib import Path
+
+# This provides the journal of a response while it streams: each chunk is
+# appended to a file in ~/.gpt_cli/journal/ as it arrives, after a header saying
+# which conversation it belongs to. The file is deleted once the turn is saved.
+# If the process dies first (killed, crashed, terminal closed), the journal is
+# left behind, and the next `ask` saves what it recorded (see
+# conversation.recover_interrupted). Each journal is locked by the process writing
+# it, so a journal whose lock can be taken was left behind.
+
+JOURNAL_PATHNAME = "~/.gpt_cli/journal/"
+JOURNAL_SUFFIX = ".jsonl"
+
+
+class Journal:
+    def __init__(self, header, pathname=JOURNAL_PATHNAME):
+        directory = Path(pathname).expanduser()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f"{os.getpid()}-{time.time_ns()}{JOURNAL_SUFFIX}"
+        self.file = open(self.path, "a", encoding="utf-8")
+        # Held until the journal is discarded or the process dies
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self._write(header)
+
+    def _write(self, value):
+        # One JSON value per line, written out at once, so only the line being
+        # written when the process died can be incomplete
+        self.file.write(json.dumps(value) + "\n")
+        self.file.flush()
+
+    def record(self, completion):
+        """
+        Yield from completion, journaling each chunk before passing it on.
+        """
+        try:
+            for text in completion:
+                self._write(text)
+                yield text
+        finally:
+            completion.close()
+
+    def discard(self):
+        """
+        Delete the journal, once what it recorded is saved.
+        """
+        self.path.unlink(missing_ok=True)
+        self.file.close()
+
+
+def pending(pathname=JOURNAL_PATHNAME):
+    """
+    Return whether there are any journals, left behind or still being written.
+    """
+    try:
+        with os.scandir(Path(pathname).expanduser()) as entries:
+            return any(entry.name.endswith(JOURNAL_SUFFIX) for entry in entries)
+    except FileNotFoundError:
+        return False
+
+
+def _read(f):
+    lines = f.read().split("\n")
+    values = []
+    for line in lines:
+        try:
+            values.append(json.loads(line))
+        except json.JSONDecodeError:
+            # The line being written when the process died, or the empty one after the last
+            break
+    return values
+
+
+def recover(pathname=JOURNAL_PATHNAME):
+    """
+    Yield (header, response so far) for each journal left behind by a process
+    that died while streaming. Each journal is deleted once the caller asks for
+    the next one, so the caller must have committed the response by then; one
+    that couldn't be saved is kept for another try. Those
+    from before any of the response arrived (e.g. a request that failed) are
+    just deleted.
+    """
+    directory = Path(pathname).expanduser()
+    if not directory.exists():
+        return
+    for path in sorted(directory.glob(f"*{JOURNAL_SUFFIX}")):
+        try:
+            f = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still being written
+                continue
+            # Another process may have recovered it while this one waited to open it
+            if os.fstat(f.fileno()).st_nlink == 0:
+                continue
+            values = _read(f)
+            if len(values) > 1:
+                yield values[0], "".join(values[1:])
+            path.unlink(missing_ok=True)
@@ -1,33 +1,148 @@
+import atexit
+import bisect
+import copy
+import json
 import pickle
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Literal
 import colorama
 from shutil import get_terminal_size
-from rich.markdown import Markdown
-from rich.console import Console
+import attachments
+from model_handling import estimate_token_count
 
 # This provides functionality for saving and displaying message history.
 
-LOG_FILENAME = "log.txt"
-FILENAME_MESSAGE_HISTORY = "message_history.pkl"
+FILENAME_MESSAGE_HISTORY = "message_history.pkl"  # legacy format, migrated on first use
+FILENAME_HISTORY_DB = "message_history.db"
 PATHNAME_MESSAGE_HISTORY = "~/.gpt_cli/"
 
+# How long a write waits for other processes' writes to the history to finish
+BUSY_TIMEOUT_SECONDS = 30
+
 USER_COLOR = colorama.Fore.BLUE
 SYSTEM_COLOR = colorama.Fore.RED
 ASSISTANT_COLOR = colorama.Style.RESET_ALL
 DEFAULT_COLOR = colorama.Style.RESET_ALL
 
+# Marks the end of a prefix that Anthropic should cache (and read back next turn)
+ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
+
+SEARCH_MATCH_START = colorama.Style.BRIGHT + colorama.Fore.BLUE
+SEARCH_MATCH_END = colorama.Style.RESET_ALL
+
 colorama.init(autoreset=True)
 
 
+class Message:
+    """
+    One message of a conversation. Roles and model names are interned, so the
+    thousands of messages in a long history share one copy of each.
+    """
+
+    __slots__ = ("role", "content", "model_name", "token_count", "attachments")
+
+    def __init__(
+        self, role, content, model_name=None, token_count=None, attachments=None
+    ):
+        self.role = sys.intern(role)
+        self.content = content
+        self.model_name = sys.intern(model_name) if model_name is not None else None
+        self.token_count = token_count
+        # References from attachments.attach, or None
+        self.attachments = attachments
+
+    @classmethod
+    def from_dict(cls, line):
+        """
+        Convert a message as older versions stored it (a plain dict).
+        """
+        return cls(
+            line["role"],
+            line["content"],
+            line.get("model_name"),
+            line.get("token_count"),
+            line.get("attachments"),
+        )
+
+    def __reduce__(self):
+        # Through __init__, so names are interned again when unpickled
+        return (
+            Message,
+            (
+                self.role,
+                self.content,
+                self.model_name,
+                self.token_count,
+                self.attachments,
+            ),
+        )
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {str(self.content)[:40]!r})"
+
+
+def _openai_entry(line):
+    return {"role": line.role, "content": message_text(line)}
+
+
+def _google_entry(line):
+    role = "model" if line.role == "assistant" else line.role
+    return {"role": role, "parts": [{"text": message_text(line)}]}
+
+
+# How each message is sent to each platform (anthropic's format is openai's)
+PLATFORM_ENTRY = {
+    "openai": _openai_entry,
+    "anthropic": _openai_entry,
+    "google": _google_entry,
+}
+
+
 class History:
     def __init__(self, chat_name, system_prompt, legacy: bool):
         self.chat_name = chat_name
         self.legacy = legacy
+        # (conversation ID, number of messages) if this is an unsaved branch
+        # continuing that conversation after its first messages (see HistoryStore.branch)
+        self.fork = None
         if self.legacy:
             self.message_history = []
         else:
-            self.message_history = [{"role": "system", "content": system_prompt}]
+            self.message_history = [Message("system", system_prompt)]
+
+    @property
+    def message_history(self):
+        return self._message_history
+
+    @message_history.setter
+    def message_history(self, message_history):
+        self._message_history = message_history
+        # Per-platform payloads, extended as messages are appended
+        self._views = {}
+        self._legacy_count = 0
+        self._legacy_prompt = ""
+
+    def __getstate__(self):
+        # The views are rebuilt on demand rather than pickled
+        return {
+            "chat_name": self.chat_name,
+            "legacy": self.is_legacy(),
+            "message_history": self._message_history,
+        }
+
+    def __setstate__(self, state):
+        self.chat_name = state["chat_name"]
+        self.legacy = state.get("legacy", False)
+        self.fork = None
+        # Pickles from before Message existed hold plain dicts
+        self.message_history = [
+            Message.from_dict(line) if isinstance(line, dict) else line
+            for line in state["message_history"]
+        ]
 
     def is_legacy(self):
         try:
@@ -36,6 +151,21 @@ class History:
         except AttributeError:
             return False
 
+    def _view(self, platform):
+        """
+        Return the cached list of this platform's payload entries, one per message,
+        first converting any messages appended since the last call.
+        """
+        entries = self._views.setdefault(platform, [])
+        if len(entries) < len(self._message_history):
+            new_lines = self._message_history[len(entries) :]
+            # assert there is no system prompt after the first message (this shouldn't happen)
+            for line in new_lines if entries else new_lines[1:]:
+                assert line.role != "system"
+            to_entry = PLATFORM_ENTRY[platform]
+            entries.extend(to_entry(line) for line in new_lines)
+        return entries
+
     def get_message_history(
         self,
         platform: Literal[
@@ -45,103 +175,161 @@ class History:
         """
         If legacy: return message history as str
         If openai/xai: return message history as list of dicts
-        If anthropic: return tuple of (system prompt, message history as list of dicts w/o system prompt)
+        If anthropic: return tuple of (system prompt, message history as list of dicts w/o system prompt),
+            with prompt-cache breakpoints on the system prompt and the last message
         If google: return tuple of (system prompt, message history), where 'assistant' is replaced with 'model' in role name
-        Else: return full message history object (which has some other stuff attached)
+        Else: return full message history object (list of Message)
+        The dicts are shared between calls, so callers must not modify them.
         """
         if platform == "legacy":
-            prompt = ""
-            for line in self.message_history:
-                prompt += line["content"]
-            return prompt
-        elif platform == "openai":
-            return [
-                {"role": line["role"], "content": line["content"]}
-                for line in self.message_history
-            ]
-        elif platform == "anthropic":
-            if self.message_history[0]["role"] == "system":
-                system_prompt = self.message_history[0]["content"]
-                other_messages = [
-                    {"role": line["role"], "content": line["content"]}
-                    for line in self.message_history[1:]
-                ]
-            else:
-                system_prompt = None
-                other_messages = [
-                    {"role": line["role"], "content": line["content"]}
-                    for line in self.message_history
-                ]
-            # assert there is no system prompt in the other messages (this shouldn't happen)
-            for line in other_messages:
-                assert line["role"] != "system"
-            # return messages and system prompt
-            return system_prompt, other_messages
-        elif platform == "google":
-            if self.message_history[0]["role"] == "system":
-                system_prompt = self.message_history[0]["content"]
-                other_messages = [
-                    {"role": line["role"], "parts": [{"text": line["content"]}]}
-                    for line in self.message_history[1:]
-                ]
+            if self._legacy_count < len(self._message_history):
+                # Held by nothing else while extended, so CPython can grow it in place
+                prompt, self._legacy_prompt = self._legacy_prompt, ""
+                prompt += "".join(
+                    message_text(line)
+                    for line in self._message_history[self._legacy_count :]
+                )
+                self._legacy_count = len(self._message_history)
+                self._legacy_prompt = prompt
+            return self._legacy_prompt
+        elif platform == "openai" or platform == "xai":
+            return list(self._view("openai"))
+        elif platform == "anthropic" or platform == "google":
+            view = self._view(platform)
+            if self._message_history[0].role == "system":
+                system_prompt = self._message_history[0].content
+                other_messages = view[1:]
             else:
                 system_prompt = None
-                other_messages = [
-                    {"role": line["role"], "parts": [{"text": line["content"]}]}
-                    for line in self.message_history
-                ]
-            # assert there is no system prompt in the other messages (this shouldn't happen)
-            for line in other_messages:
-                assert line["role"] != "system"
-            # if google, replace 'assistant' with 'model' role name
-            if platform == "google":
-                for line in other_messages:
-                    if line["role"] == "assistant":
-                        line["role"] = "model"
+                other_messages = list(view)
+            if platform == "anthropic":
+                # Cache the system prompt, and everything up to the latest message,
+                # which is where the next turn's request will find it
+                if system_prompt is not None:
+                    system_prompt = [
+                        {
+                            "type": "text",
+                            "text": system_prompt,
+                            "cache_control": ANTHROPIC_CACHE_CONTROL,
+                        }
+                    ]
+                if other_messages:
+                    last = other_messages[-1]
+                    other_messages[-1] = {
+                        "role": last["role"],
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": last["content"],
+                                "cache_control": ANTHROPIC_CACHE_CONTROL,
+                            }
+                        ],
+                    }
             # return messages and system prompt
             return system_prompt, other_messages
         else:
-            return self.message_history
+            return self._message_history
 
     def get_chat_name(self):
         return self.chat_name
 
-    def append_user_message(self, user_prompt):
-        self.message_history.append({"role": "user", "content": user_prompt})
+    def count_turns(self):
+        """
+        Return the number of turns, a turn being a prompt and its response.
+        """
+        return sum(line.role == "user" for line in self._message_history)
 
-    def append_response(self, response, model_name):
-        self.message_history.append(
-            {"role": "assistant", "content": response, "model_name": model_name}
+    def turn_boundary(self, turns):
+        """
+        Return how many messages the conversation's first `turns` turns take up
+        (with the system prompt). Raises ValueError if it has fewer turns.
+        """
+        starts = [
+            position
+            for position, line in enumerate(self._message_history)
+            if line.role == "user"
+        ]
+        if not 0 <= turns <= len(starts):
+            raise ValueError(
+                f"Conversation {self.chat_name} has {len(starts)} turns, so there is no turn {turns} to branch from."
+            )
+        return starts[turns] if turns < len(starts) else len(self._message_history)
+
+    def get_token_count(self, line):
+        """
+        Return the (estimated) token count of one message, computing it only the
+        first time and keeping it with the message.
+        """
+        if line.token_count is None:
+            line.token_count = estimate_token_count(message_text(line))
+        return line.token_count
+
+    def with_message_history(self, message_history):
+        """
+        Return a copy of this conversation holding the given messages instead.
+        """
+        history = copy.copy(self)
+        history.message_history = message_history
+        return history
+
+    def append_user_message(self, user_prompt, attachments=None):
+        """
+        Append the prompt, with the files in attachments (references from
+        attachments.attach) sent after it. Only the references are saved.
+        """
+        self._message_history.append(
+            Message("user", user_prompt, attachments=attachments or None)
         )
 
+    def append_response(self, response, model_name):
+        self._message_history.append(Message("assistant", response, model_name))
+
     def _compute_pad_len(self):
         models_in_conversation = {"system"}
         for line in self.message_history:
-            if line["role"] == "assistant":
-                models_in_conversation.add(line["model_name"])
+            if line.role == "assistant":
+                models_in_conversation.add(line.model_name)
         return max(map(len, models_in_conversation)) + 1
 
     def display(self):
         if not self.is_legacy():
+            from rich.markdown import Markdown
+            from rich.console import Console
+
             console = Console()
             pad_len = self._compute_pad_len()
+            turn = 0
             for line in self.message_history:
-                color = _get_line_color(line["role"])
-                role_name = (
-                    line["role"] if line["role"] != "assistant" else line["model_name"]
-                )
+                color = _get_line_color(line.role)
+                role_name = line.role if line.role != "assistant" else line.model_name
+                if line.role == "user":
+                    # Numbered for --from-turn
+                    turn += 1
+                    role_name = f"user [turn {turn}]"
                 role = (role_name + ":").ljust(pad_len)
-                content = Markdown(line["content"])
+                content = Markdown(line.content)
                 print(f"{color}{role}", flush=True)
                 console.print(content)
+                for attachment in line.attachments or []:
+                    print(f"{color}[attached: {attachment['name']}]", flush=True)
         else:
             for line in self.message_history:
-                color = _get_line_color(line["role"])
-                content = line["content"]
+                color = _get_line_color(line.role)
+                content = line.content
                 print(f"{color}{content}", end="", flush=True)
             print()
 
 
+def message_text(line):
+    """
+    Return the text sent to the model for a message: its content, followed by any
+    attached files.
+    """
+    if line.attachments is None:
+        return line.content
+    return line.content + attachments.render(line.attachments)
+
+
 def _get_line_color(role):
     if role == "user":
         color = USER_COLOR
@@ -154,58 +342,684 @@ def _get_line_color(role):
     return color
 
 
-def is_history_list(
-    pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
-):
-    path = Path(pathname).expanduser() / filename
-    return path.exists()
+def _history_path(pathname, filename):
+    return Path(pathname).expanduser() / filename
 
 
-def init_history_list(
-    pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
-):
-    if not Path(pathname).expanduser().exists():
-        Path(pathname).expanduser().mkdir()
-    path = Path(pathname).expanduser() / filename
-    with open(path, "wb") as f:
-        pickle.dump({"chat_names": [], "history_list": []}, f)
+# Each entry upgrades the database schema by one version; the database's
+# user_version records how many of them have been applied
+SCHEMA_MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY,
+        chat_name TEXT NOT NULL,
+        legacy INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        conversation_id INTEGER NOT NULL REFERENCES conversations(id),
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        model_name TEXT
+    );
+    CREATE INDEX IF NOT EXISTS messages_by_conversation
+        ON messages(conversation_id, id);
+    CREATE UNIQUE INDEX IF NOT EXISTS conversations_by_chat_name
+        ON conversations(chat_name);
+    """,
+    """
+    ALTER TABLE messages ADD COLUMN token_count INTEGER;
+    -- Same estimate as model_handling.estimate_token_count
+    UPDATE messages SET token_count = (length(content) + 3) / 4;
+    """,
+    """
+    -- Full-text index over message contents, kept up to date by a trigger
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        content, content='messages', content_rowid='id'
+    );
+    INSERT INTO messages_fts(messages_fts) VALUES ('rebuild');
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+    """
+    -- One small row per conversation, so listing never reads message bodies
+    CREATE TABLE conversation_summaries (
+        conversation_id INTEGER PRIMARY KEY REFERENCES conversations(id),
+        first_line TEXT NOT NULL,
+        last_line TEXT NOT NULL,
+        model_name TEXT,
+        updated_at REAL
+    );
+    CREATE INDEX conversation_summaries_by_time
+        ON conversation_summaries(updated_at);
+    INSERT INTO conversation_summaries
+    SELECT id,
+        COALESCE((SELECT substr(content, 1, 200) FROM messages
+            WHERE conversation_id = conversations.id AND role != 'system'
+            ORDER BY id LIMIT 1), ''),
+        COALESCE((SELECT substr(content, -200) FROM messages
+            WHERE conversation_id = conversations.id
+            ORDER BY id DESC LIMIT 1), ''),
+        (SELECT model_name FROM messages
+            WHERE conversation_id = conversations.id AND model_name IS NOT NULL
+            ORDER BY id DESC LIMIT 1),
+        NULL
+    FROM conversations;
+    """,
+    """
+    -- Attached files, as a JSON list of {"name", "sha256"} (see attachments.py)
+    ALTER TABLE messages ADD COLUMN attachments TEXT;
+    """,
+    """
+    -- A conversation branched off another stores only its own messages, the
+    -- ones after fork_message_id (the last message it shares with the other)
+    ALTER TABLE conversations ADD COLUMN fork_message_id INTEGER REFERENCES messages(id);
+    CREATE INDEX conversations_by_fork ON conversations(fork_message_id);
+    """,
+    """
+    -- Responses are updated in place when continued (see update_response)
+    CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+    """
+    -- System prompts are left out of the full-text index: most conversations
+    -- share the default one, so every search for a word in it matched them all
+    DROP TRIGGER messages_fts_insert;
+    DROP TRIGGER messages_fts_update;
+    INSERT INTO messages_fts(messages_fts) VALUES ('delete-all');
+    INSERT INTO messages_fts(rowid, content)
+        SELECT id, content FROM messages WHERE role != 'system';
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages
+    WHEN new.role != 'system' BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages
+    WHEN new.role != 'system' BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+]
 
+# Characters of the first and last message kept in conversation_summaries
+# (the 200 in the migration that creates that table)
+SUMMARY_LINE_LENGTH = 200
 
-def get_chat_names(
-    pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
-):
-    path = Path(pathname).expanduser() / filename
-    with open(path, "rb") as f:
-        d = pickle.load(f)
-        return d["chat_names"]
+
+@contextmanager
+def _write_transaction(conn):
+    """
+    Run the block in a transaction that holds the database's write lock from the
+    start, so nothing it reads can change before it writes. Other processes'
+    writes wait for it (up to BUSY_TIMEOUT_SECONDS), and it for them.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _statements(script):
+    # executescript() would commit the transaction the script is meant to run
+    # in, so run it a statement at a time; complete_statement() knows that
+    # trigger bodies contain semicolons
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def _create_schema(conn):
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version == len(SCHEMA_MIGRATIONS):
+        return
+    # Another process may be upgrading the database too, so look again once
+    # holding the write lock
+    with _write_transaction(conn):
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        for version in range(version, len(SCHEMA_MIGRATIONS)):
+            for statement in _statements(SCHEMA_MIGRATIONS[version]):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
+
+INSERT_CONVERSATION_SQL = "INSERT INTO conversations (id, chat_name, legacy, fork_message_id) VALUES (?, ?, ?, ?)"
+INSERT_MESSAGE_SQL = "INSERT INTO messages (conversation_id, role, content, model_name, token_count, attachments) VALUES (?, ?, ?, ?, ?, ?)"
 
 
-def get_history_list(
-    pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
+def _message_rows(conv_id, history, start=0):
+    return [
+        (
+            conv_id,
+            line.role,
+            line.content,
+            line.model_name,
+            history.get_token_count(line),
+            json.dumps(line.attachments) if line.attachments is not None else None,
+        )
+        for line in history.get_message_history()[start:]
+    ]
+
+
+INSERT_SUMMARY_SQL = "INSERT INTO conversation_summaries (conversation_id, first_line, last_line, model_name, updated_at) VALUES (?, ?, ?, ?, ?)"
+UPDATE_SUMMARY_SQL = "UPDATE conversation_summaries SET last_line = ?, model_name = ?, updated_at = ? WHERE conversation_id = ?"
+UPDATE_RESPONSE_SQL = "UPDATE messages SET content = ?, token_count = ?, model_name = ? WHERE id = (SELECT MAX(id) FROM messages WHERE conversation_id = ?) AND role = 'assistant'"
+UPDATE_SUMMARY_LAST_LINE_SQL = "UPDATE conversation_summaries SET last_line = ?, model_name = ?, updated_at = ? WHERE conversation_id = ?"
+
+
+def _summary_row(conv_id, history, updated_at):
+    messages = [line for line in history.get_message_history() if line.role != "system"]
+    if not messages:
+        return (conv_id, "", "", None, updated_at)
+    model_names = [line.model_name for line in messages if line.model_name]
+    return (
+        conv_id,
+        messages[0].content[:SUMMARY_LINE_LENGTH],
+        messages[-1].content[-SUMMARY_LINE_LENGTH:],
+        model_names[-1] if model_names else None,
+        updated_at,
+    )
+
+
+def _insert_conversation(
+    conn, conv_id, history, updated_at=None, fork_message_id=None, shared=0
 ):
-    path = Path(pathname).expanduser() / filename
-    with open(path, "rb") as f:
-        d = pickle.load(f)
-        return d["history_list"]
+    """
+    Insert history as conversation conv_id. If it is a branch, fork_message_id
+    is the last of the shared first messages, which aren't stored again.
+    """
+    conn.execute(
+        INSERT_CONVERSATION_SQL,
+        (conv_id, history.get_chat_name(), int(history.is_legacy()), fork_message_id),
+    )
+    conn.executemany(INSERT_MESSAGE_SQL, _message_rows(conv_id, history, shared))
+    conn.execute(INSERT_SUMMARY_SQL, _summary_row(conv_id, history, updated_at))
+
+
+def _migrate_pickle(conn, pathname):
+    """
+    One-time import of the old single-blob message_history.pkl into the database.
+    The pickle is renamed (not deleted) afterwards so it is never imported twice.
+    """
+    pickle_path = _history_path(pathname, FILENAME_MESSAGE_HISTORY)
+    if not pickle_path.exists():
+        return
+    with _write_transaction(conn):
+        # Unless another process has imported it meanwhile
+        if not pickle_path.exists():
+            return
+        with open(pickle_path, "rb") as f:
+            d = pickle.load(f)
+        for conv_id, history in enumerate(d["history_list"]):
+            _insert_conversation(conn, conv_id, history)
+        # Renamed before the import is committed, so no other process that
+        # gets the write lock after this one still sees the pickle
+        pickle_path.rename(pickle_path.with_suffix(".pkl.migrated"))
+
+
+def _connect(pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    Path(pathname).expanduser().mkdir(exist_ok=True)
+    # The ask daemon uses its store from several threads, serialized by its own lock
+    conn = sqlite3.connect(
+        _history_path(pathname, filename),
+        timeout=BUSY_TIMEOUT_SECONDS,
+        check_same_thread=False,
+    )
+    # Write-ahead logging: readers (ask -d, --search, other invocations loading a
+    # conversation) don't wait for a writer, nor a writer for them
+    conn.execute("PRAGMA journal_mode = WAL")
+    _create_schema(conn)
+    _migrate_pickle(conn, pathname)
+    return conn
+
+
+def _next_conversation_id(conn):
+    (conv_id,) = conn.execute(
+        "SELECT COALESCE(MAX(id), -1) + 1 FROM conversations"
+    ).fetchone()
+    return conv_id
+
+
+def _load_history(conn, conv_id, load_prefix):
+    """
+    Return (history, message IDs) for the conversation. A branch's shared first
+    messages come from load_prefix(fork_message_id), which returns them the same way.
+    """
+    row = conn.execute(
+        "SELECT chat_name, legacy, fork_message_id FROM conversations WHERE id = ?",
+        (conv_id,),
+    ).fetchone()
+    if row is None:
+        raise IndexError(f"No conversation with ID {conv_id}")
+    chat_name, legacy, fork_message_id = row
+    if fork_message_id is not None:
+        messages, message_ids = load_prefix(fork_message_id)
+    else:
+        messages, message_ids = [], []
+    for message_id, role, content, model_name, token_count, attached in conn.execute(
+        "SELECT id, role, content, model_name, token_count, attachments FROM messages WHERE conversation_id = ? ORDER BY id",
+        (conv_id,),
+    ):
+        message_ids.append(message_id)
+        messages.append(
+            Message(
+                role,
+                content,
+                model_name,
+                token_count,
+                json.loads(attached) if attached is not None else None,
+            )
+        )
+    history = History(chat_name, None, legacy=bool(legacy))
+    history.message_history = messages
+    return history, message_ids
+
+
+# The conversations a branch's shared prefix comes from, each with the last of
+# its messages in it, up the chain of forks
+SHARED_TURNS_SQL = """
+WITH RECURSIVE prefix(conversation_id, last_id) AS (
+    SELECT conversation_id, id FROM messages WHERE id = ?
+    UNION ALL
+    SELECT messages.conversation_id, messages.id FROM prefix
+        JOIN conversations ON conversations.id = prefix.conversation_id
+        JOIN messages ON messages.id = conversations.fork_message_id
+)
+SELECT COUNT(*) FROM prefix JOIN messages
+    ON messages.conversation_id = prefix.conversation_id AND messages.id <= prefix.last_id
+WHERE messages.role = 'user'
+"""
+
+
+def _shared_turns(conn, fork_message_id):
+    """
+    Return how many turns a branch shares with its parent, counted from IDs alone.
+    """
+    (turns,) = conn.execute(SHARED_TURNS_SQL, (fork_message_id,)).fetchone()
+    return turns
+
+
+class HistoryStore:
+    """
+    One open connection to the history database, plus everything read from it,
+    for the lifetime of a process. Other processes may write to the same
+    database at the same time. New conversations are saved at once, since their
+    IDs are only allotted then; other writes are queued and committed together
+    by flush(), which runs once at exit.
+    """
+
+    def __init__(self, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+        self.conn = _connect(pathname, filename)
+        self._chat_names = None
+        self._histories = {}
+        self._message_ids = {}  # conversation ID -> IDs of its (saved) messages
+        self._next_id = _next_conversation_id(self.conn)
+        self._pending = []
+        # Changes whenever another connection commits (see _drop_stale)
+        self._data_version = self._read_data_version()
+        atexit.register(self.close)
+
+    def _read_data_version(self):
+        (data_version,) = self.conn.execute("PRAGMA data_version").fetchone()
+        return data_version
+
+    def _drop_stale(self):
+        """
+        Forget everything read from the database if another process (another
+        `ask`, or the daemon) has written to it since, so a long-lived store
+        doesn't serve conversations without their latest turns.
+        """
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._chat_names = None
+            self._histories.clear()
+            self._message_ids.clear()
+
+    def resolve_index(self, index):
+        """
+        Conversation IDs are their positions in the history, so negative indices
+        (e.g. -1 for most recent) count back from the number of conversations.
+        """
+        if index < 0:
+            # Counting in conversations other processes have saved since
+            self._next_id = _next_conversation_id(self.conn)
+            index += self._next_id
+        return index
+
+    def get_chat_names(self):
+        if self._chat_names is not None:
+            self._drop_stale()
+        if self._chat_names is None:
+            self.flush()
+            self._chat_names = [
+                chat_name
+                for (chat_name,) in self.conn.execute(
+                    "SELECT chat_name FROM conversations ORDER BY id"
+                )
+            ]
+        return self._chat_names
+
+    def get_history(self, index):
+        conv_id = self.resolve_index(index)
+        if self._histories:
+            self._drop_stale()
+        if conv_id not in self._histories:
+            self.flush()
+            history, message_ids = _load_history(
+                self.conn, conv_id, self._shared_prefix
+            )
+            self._histories[conv_id] = history
+            self._message_ids[conv_id] = message_ids
+        return self._histories[conv_id]
+
+    def _shared_prefix(self, fork_message_id):
+        # The messages of a branch's parent up to the fork, as the same Message
+        # objects, so branches share their prefix in memory as well as on disk
+        conv_id, position = self._locate(fork_message_id)
+        return (
+            self._histories[conv_id].message_history[:position],
+            self._message_ids[conv_id][:position],
+        )
+
+    def _locate(self, message_id):
+        """
+        Return (conversation ID, n): the message is the nth of that conversation.
+        """
+        (conv_id,) = self.conn.execute(
+            "SELECT conversation_id FROM messages WHERE id = ?", (message_id,)
+        ).fetchone()
+        self.get_history(conv_id)
+        # IDs only grow along a conversation, branch or not
+        return conv_id, bisect.bisect_right(self._message_ids[conv_id], message_id)
+
+    def branch(self, index, n_messages):
+        """
+        Return a new, unsaved conversation that continues conversation index
+        after its first n_messages. Those messages are shared with it, not
+        copied, and stay shared once it is saved.
+        """
+        conv_id = self.resolve_index(index)
+        parent = self.get_history(conv_id)
+        history = parent.with_message_history(parent.message_history[:n_messages])
+        history.chat_name = None
+        history.fork = (conv_id, n_messages)
+        return history
+
+    def get_forks(self):
+        """
+        Return {conversation ID: (parent's ID, turns shared with the parent)} for
+        every conversation that was branched off another.
+        """
+        self.flush()
+        return {
+            conv_id: (parent_id, _shared_turns(self.conn, fork_message_id))
+            for conv_id, parent_id, fork_message_id in self.conn.execute(
+                "SELECT conversations.id, messages.conversation_id, fork_message_id FROM conversations JOIN messages ON messages.id = fork_message_id"
+            ).fetchall()
+        }
+
+    def get_fork(self, index):
+        """
+        Return (parent's ID, turns shared with the parent) if conversation index
+        was branched off another, otherwise None. No messages are loaded.
+        """
+        self.flush()
+        row = self.conn.execute(
+            "SELECT messages.conversation_id, fork_message_id FROM conversations JOIN messages ON messages.id = fork_message_id WHERE conversations.id = ?",
+            (self.resolve_index(index),),
+        ).fetchone()
+        if row is None:
+            return None
+        parent_id, fork_message_id = row
+        return parent_id, _shared_turns(self.conn, fork_message_id)
+
+    def get_branches(self, index):
+        """
+        Return [(ID, turns shared with it)] for the conversations branched off
+        conversation index, oldest first. No messages are loaded.
+        """
+        self.flush()
+        return [
+            (conv_id, _shared_turns(self.conn, fork_message_id))
+            for conv_id, fork_message_id in self.conn.execute(
+                "SELECT conversations.id, fork_message_id FROM conversations JOIN messages ON messages.id = fork_message_id WHERE messages.conversation_id = ? ORDER BY conversations.id",
+                (self.resolve_index(index),),
+            ).fetchall()
+        ]
+
+    def get_history_list(self):
+        return [self.get_history(conv_id) for conv_id in range(self._next_id)]
+
+    def can_append(self, history):
+        return history.get_chat_name() not in self.get_chat_names()
+
+    def append_history(self, history):
+        """
+        Save history as a new conversation and return its ID. It gets the next
+        ID of all those saved so far, by any process, and is named by it. A
+        branch (see branch()) saves only the messages it doesn't share.
+        """
+        self.flush()
+        fork_message_id = None
+        shared = 0
+        if history.fork is not None:
+            parent_id, shared = history.fork
+            self.get_history(parent_id)
+            if shared > 0:
+                fork_message_id = self._message_ids[parent_id][shared - 1]
+        with _write_transaction(self.conn):
+            conv_id = _next_conversation_id(self.conn)
+            history.chat_name = str(conv_id)
+            _insert_conversation(
+                self.conn, conv_id, history, time.time(), fork_message_id, shared
+            )
+        # Saved now; further turns are added with update_history
+        history.fork = None
+        self._next_id = conv_id + 1
+        # Other processes may have added conversations too
+        self._chat_names = None
+        return conv_id
+
+    def update_history(
+        self, reply_index, user_prompt, response, model_name, attachments=None
+    ):
+        conv_id = self.resolve_index(reply_index)
+        user_line = Message("user", user_prompt, attachments=attachments or None)
+        # Callers may hold (and have modified) the cached object, so reload on next read
+        self._histories.pop(conv_id, None)
+        self._message_ids.pop(conv_id, None)
+        self._pending.append(
+            (
+                INSERT_MESSAGE_SQL,
+                [
+                    (
+                        conv_id,
+                        "user",
+                        user_prompt,
+                        None,
+                        estimate_token_count(message_text(user_line)),
+                        json.dumps(attachments) if attachments else None,
+                    ),
+                    (
+                        conv_id,
+                        "assistant",
+                        response,
+                        model_name,
+                        estimate_token_count(response),
+                        None,
+                    ),
+                ],
+            )
+        )
+        self._pending.append(
+            (
+                UPDATE_SUMMARY_SQL,
+                [
+                    (
+                        response[-SUMMARY_LINE_LENGTH:],
+                        model_name,
+                        time.time(),
+                        conv_id,
+                    )
+                ],
+            )
+        )
+        return conv_id
+
+    def update_response(self, index, content, model_name):
+        """
+        Replace the response that ends conversation index with content (e.g.
+        the response followed by its continuation) by model_name, and return
+        the conversation's ID.
+        """
+        conv_id = self.resolve_index(index)
+        self._histories.pop(conv_id, None)
+        self._message_ids.pop(conv_id, None)
+        self._pending.append(
+            (
+                UPDATE_RESPONSE_SQL,
+                [(content, estimate_token_count(content), model_name, conv_id)],
+            )
+        )
+        self._pending.append(
+            (
+                UPDATE_SUMMARY_LAST_LINE_SQL,
+                [(content[-SUMMARY_LINE_LENGTH:], model_name, time.time(), conv_id)],
+            )
+        )
+        return conv_id
+
+    def get_summaries(self, limit=None, offset=0, since=None):
+        """
+        Return (chat name, first line, last line) for each conversation, oldest
+        first. With limit/offset, return the limit most recent ones after
+        skipping the offset most recent; with since (a Unix time), only those
+        with a turn saved since then.
+        """
+        self.flush()
+        rows = self.conn.execute(
+            """
+            SELECT conversations.chat_name, first_line, last_line
+            FROM conversation_summaries
+            JOIN conversations ON conversations.id = conversation_summaries.conversation_id
+            WHERE ? IS NULL OR updated_at >= ?
+            ORDER BY conversation_id DESC
+            LIMIT ? OFFSET ?
+            """,
+            (since, since, -1 if limit is None else limit, offset),
+        ).fetchall()
+        return rows[::-1]
+
+    def search(self, query, limit):
+        """
+        Return up to limit (chat name, snippet) pairs for the conversations whose
+        messages best match query, best first. Raises ValueError if query has no
+        word to look for (only punctuation, or nothing at all).
+        """
+        # Only letters and digits are indexed
+        words = [word for word in query.split() if any(c.isalnum() for c in word)]
+        if not words:
+            raise ValueError("--search needs at least one word to look for.")
+        self.flush()
+        # Quote each word so punctuation in the query isn't read as FTS5 syntax
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+        rows = self.conn.execute(
+            f"""
+            SELECT conversations.chat_name,
+                   snippet(messages_fts, 0, '{SEARCH_MATCH_START}', '{SEARCH_MATCH_END}', '...', 16)
+            FROM messages_fts
+            JOIN messages ON messages.id = messages_fts.rowid
+            JOIN conversations ON conversations.id = messages.conversation_id
+            WHERE messages_fts MATCH ?
+            ORDER BY bm25(messages_fts)
+            """,
+            (match,),
+        )
+        # Keep the best-matching message of each conversation
+        results = {}
+        for chat_name, snippet in rows:
+            if chat_name not in results:
+                results[chat_name] = snippet
+                if len(results) == limit:
+                    break
+        return list(results.items())
+
+    def flush(self):
+        if not self._pending:
+            return
+        with _write_transaction(self.conn):
+            for sql, rows in self._pending:
+                self.conn.executemany(sql, rows)
+        self._pending = []
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.flush()
+        self.conn.close()
+        self.conn = None
+
+
+_stores = {}
+
+
+def open_store(pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    """
+    Return the process-wide HistoryStore for this path, opening it on first use.
+    """
+    path = _history_path(pathname, filename)
+    if path not in _stores:
+        _stores[path] = HistoryStore(pathname, filename)
+    return _stores[path]
+
+
+def is_history_list(pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    return (
+        _history_path(pathname, filename).exists()
+        or _history_path(pathname, FILENAME_MESSAGE_HISTORY).exists()
+    )
+
+
+def init_history_list(pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    open_store(pathname, filename)
+
+
+def get_chat_names(pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    return open_store(pathname, filename).get_chat_names()
+
+
+def get_history_list(pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    return open_store(pathname, filename).get_history_list()
+
+
+def get_history(index, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB):
+    """
+    Load a single conversation (by ID, negative indices allowed) without reading any other.
+    """
+    return open_store(pathname, filename).get_history(index)
 
 
 def can_append(
-    history, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
+    history, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB
 ):
-    return history.get_chat_name() not in get_history_list(pathname, filename)
+    return open_store(pathname, filename).can_append(history)
 
 
 def append_history(
-    history, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
+    history, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB
 ):
-    if can_append(history, pathname, filename):
-        chat_names = get_chat_names(pathname, filename)
-        history_list = get_history_list(pathname, filename)
-        chat_names.append(history.get_chat_name())
-        path = Path(pathname).expanduser() / filename
-        history_list.append(history)
-        with open(path, "wb") as f:
-            pickle.dump({"chat_names": chat_names, "history_list": history_list}, f)
+    open_store(pathname, filename).append_history(history)
 
 
 def update_history(
@@ -214,52 +1028,113 @@ def update_history(
     response,
     model_name,
     pathname=PATHNAME_MESSAGE_HISTORY,
-    filename=FILENAME_MESSAGE_HISTORY,
+    filename=FILENAME_HISTORY_DB,
+    attachments=None,
 ):
-    chat_names = get_chat_names(pathname, filename)
-    history_list = get_history_list(pathname, filename)
-    history_list[reply_index].append_user_message(user_prompt)
-    history_list[reply_index].append_response(response, model_name)
-    path = Path(pathname).expanduser() / filename
-    with open(path, "wb") as f:
-        pickle.dump({"chat_names": chat_names, "history_list": history_list}, f)
+    open_store(pathname, filename).update_history(
+        reply_index, user_prompt, response, model_name, attachments
+    )
 
 
-def _display_history_line(chat_name, history):
+def _display_history_line(chat_name, first_line, last_line):
     line_length = get_terminal_size().columns
     start_length = line_length // 2 - 2 - len(chat_name)
     end_length = line_length // 2 - 2 - len(chat_name)
-    start_idx = 0 if history.is_legacy() else 1
-    start_message = f"{USER_COLOR}{history.get_message_history()[start_idx]['content'][:start_length]}".replace(
+    start_message = f"{USER_COLOR}{first_line[:start_length]}".replace(
         "\n", ""
-    ).replace(
-        "\r", ""
-    )
-    end_message = f"{ASSISTANT_COLOR}{history.get_message_history()[-1]['content'][-end_length:]}".replace(
+    ).replace("\r", "")
+    end_message = f"{ASSISTANT_COLOR}{last_line[-end_length:]}".replace(
         "\n", ""
-    ).replace(
-        "\r", ""
-    )
+    ).replace("\r", "")
     print(f"{chat_name}: {start_message}...{end_message}")
 
 
 def display_history(
-    index, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
+    index, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB
 ):
-    history_list = get_history_list(pathname, filename)
-    history_list[index].display()
+    store = open_store(pathname, filename)
+    store.get_history(index).display()
+    conv_id = store.resolve_index(index)
+    fork = store.get_fork(conv_id)
+    if fork is not None:
+        parent_id, turns = fork
+        print(f"(branched off conversation {parent_id} after turn {turns})")
+    branches = [child for child, _ in store.get_branches(conv_id)]
+    if branches:
+        print(f"(branches: {', '.join(map(str, branches))})")
+
+
+def display_tree(
+    index=None, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB
+):
+    """
+    Show the conversation's branches as a tree, from the conversation it was
+    first branched off. Without index, show every conversation with branches.
+    """
+    store = open_store(pathname, filename)
+    if index is not None:
+        # Only this conversation's tree is looked up
+        root = store.resolve_index(index)
+        store.get_history(root)  # raises IndexError if there is no such conversation
+        fork = store.get_fork(root)
+        while fork is not None:
+            root = fork[0]
+            fork = store.get_fork(root)
+        roots = [root]
+        get_branches = store.get_branches
+    else:
+        forks = store.get_forks()
+        children = {}
+        for child, (parent_id, turns) in sorted(forks.items()):
+            children.setdefault(parent_id, []).append((child, turns))
+        roots = sorted(parent_id for parent_id in children if parent_id not in forks)
+        if not roots:
+            print("No conversation has branches.")
+            return
+
+        def get_branches(conv_id):
+            return children.get(conv_id, [])
+
+    def show(conv_id, label, indent, shared_turns):
+        history = store.get_history(conv_id)
+        # What the branch says first itself, rather than the prefix it shares
+        own = history.message_history[history.turn_boundary(shared_turns) :]
+        first_line = own[0].content if own else ""
+        last_line = history.message_history[-1].content
+        _display_history_line(label, first_line, last_line)
+        branches = get_branches(conv_id)
+        for position, (child, turns) in enumerate(branches):
+            last = position == len(branches) - 1
+            connector = "└─ " if last else "├─ "
+            show(
+                child,
+                f"{indent}{connector}{child} (from turn {turns})",
+                indent + ("   " if last else "│  "),
+                turns,
+            )
+
+    for root in roots:
+        show(root, str(root), "", 0)
 
 
 def display_all_history(
-    pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_MESSAGE_HISTORY
+    limit=None,
+    offset=0,
+    since=None,
+    pathname=PATHNAME_MESSAGE_HISTORY,
+    filename=FILENAME_HISTORY_DB,
 ):
-    chat_names = get_chat_names(pathname, filename)
-    history_list = get_history_list(pathname, filename)
-    for chat_name, history in zip(chat_names, history_list):
-        _display_history_line(chat_name, history)
+    summaries = open_store(pathname, filename).get_summaries(limit, offset, since)
+    for chat_name, first_line, last_line in summaries:
+        _display_history_line(chat_name, first_line, last_line)
 
 
-def write_to_log(content, pathname=PATHNAME_MESSAGE_HISTORY, filename=LOG_FILENAME):
-    path = Path(pathname).expanduser() / filename
-    with open(path, "a") as f:
-        f.write(content)
+def search_history(
+    query, limit, pathname=PATHNAME_MESSAGE_HISTORY, filename=FILENAME_HISTORY_DB
+):
+    results = open_store(pathname, filename).search(query, limit)
+    if not results:
+        print("No matching conversations.")
+    for chat_name, snippet in results:
+        snippet = snippet.replace("\n", " ").replace("\r", "")
+        print(f"{chat_name}: {snippet}")
@@ -0,0 +1,153 @@
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from model_handling import estimate_token_count, model_name_to_provider
+
+# This provides per-request latency and throughput metrics, one JSON object per
+# line in ~/.gpt_cli/metrics.jsonl, and `ask --stats` to summarize them.
+
+METRICS_PATHNAME = "~/.gpt_cli/"
+METRICS_FILENAME = "metrics.jsonl"
+
+# Columns of `ask --stats`: (record field, heading, format)
+STATS_FIELDS = [
+    ("time_to_first_token", "TTFT s", "{:.2f}"),
+    ("total_time", "total s", "{:.2f}"),
+    ("inter_chunk_mean", "chunk gap ms", "{:.0f}"),
+    ("tokens_per_second", "tok/s", "{:.0f}"),
+]
+STATS_PERCENTILES = [50, 95, 99]
+
+
+def _percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[index]
+
+
+def timed(completion, record, usage=None):
+    """
+    Yield from completion, recording in record how long the provider took to
+    send the first chunk and each following one, and how long the consumer (the
+    renderer) took with each chunk. The record is complete once the stream
+    finishes or is abandoned. If the request's usage dict is given, times are
+    counted from when the request was sent (see providers.stream_response), and
+    what came before it (importing the SDK, making the client) is setup_time.
+    """
+    start = time.perf_counter()
+    last_chunk = start
+    gaps = []
+    consumer_time = 0.0
+    pieces = []
+    try:
+        for text in completion:
+            now = time.perf_counter()
+            if not pieces:
+                request_sent = usage.get("request_sent") if usage else None
+                if request_sent is not None and start < request_sent < now:
+                    record["setup_time"] = request_sent - start
+                    start = request_sent
+                record["time_to_first_token"] = now - start
+            else:
+                gaps.append(now - last_chunk)
+            pieces.append(text)
+            yield text
+            resumed = time.perf_counter()
+            consumer_time += resumed - now
+            last_chunk = now
+    finally:
+        total_time = time.perf_counter() - start
+        record["total_time"] = total_time
+        record["render_time"] = consumer_time
+        record["chunks"] = len(pieces)
+        if gaps:
+            gaps.sort()
+            record["inter_chunk_mean"] = 1000 * sum(gaps) / len(gaps)
+            record["inter_chunk_p95"] = 1000 * _percentile(gaps, 95)
+        record["estimated_output_tokens"] = estimate_token_count("".join(pieces))
+
+
+def finish_record(record, model_name, provider, usage, interrupted):
+    """
+    Add the request's identity and provider-reported token usage to record. If
+    a fallback model answered instead of model_name (see failover.py), the
+    record is filed under the fallback.
+    """
+    record["time"] = time.time()
+    answered_by = usage.get("model", model_name)
+    if answered_by != model_name:
+        record["requested_model"] = model_name
+        provider = model_name_to_provider(answered_by)
+    record["model"] = answered_by
+    record["provider"] = provider
+    if usage.get("attempts"):
+        record["attempts"] = len(usage["attempts"])
+    record["interrupted"] = interrupted
+    record["cached"] = usage.get("cached", False)
+    for key in [
+        "input_tokens",
+        "output_tokens",
+        "cache_read_tokens",
+        "cache_write_tokens",
+    ]:
+        if usage.get(key) is not None:
+            record[key] = usage[key]
+    output_tokens = record.get("output_tokens", record["estimated_output_tokens"])
+    generation_time = record["total_time"] - record.get("time_to_first_token", 0)
+    if output_tokens and generation_time > 0 and not record["cached"]:
+        record["tokens_per_second"] = output_tokens / generation_time
+    return record
+
+
+def log_metrics(record, pathname=METRICS_PATHNAME, filename=METRICS_FILENAME):
+    path = Path(pathname).expanduser() / filename
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_metrics(since=None, pathname=METRICS_PATHNAME, filename=METRICS_FILENAME):
+    path = Path(pathname).expanduser() / filename
+    if not path.exists():
+        return
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if since is None or record["time"] >= since:
+                yield record
+
+
+def display_stats(since=None, pathname=METRICS_PATHNAME, filename=METRICS_FILENAME):
+    groups = defaultdict(list)
+    for record in read_metrics(since, pathname, filename):
+        # Cache hits say nothing about the provider
+        if not record.get("cached"):
+            groups[(record["provider"], record["model"])].append(record)
+    if not groups:
+        print("No metrics recorded in this time window.")
+        return
+
+    for (provider, model_name), records in sorted(groups.items()):
+        print(f"{provider} / {model_name}: {len(records)} requests")
+        percentile_names = "  ".join(f"{'p' + str(p):>8}" for p in STATS_PERCENTILES)
+        print(f"  {'':<14}{percentile_names}")
+        for field, heading, number_format in STATS_FIELDS:
+            values = sorted(record[field] for record in records if field in record)
+            if not values:
+                continue
+            cells = "  ".join(
+                f"{number_format.format(_percentile(values, p)):>8}"
+                for p in STATS_PERCENTILES
+            )
+            print(f"  {heading:<14}{cells}")
+        input_tokens = sum(record.get("input_tokens", 0) for record in records)
+        output_tokens = sum(record.get("output_tokens", 0) for record in records)
+        print(f"  tokens in/out: {input_tokens}/{output_tokens}")
+        cache_read = sum(record.get("cache_read_tokens") or 0 for record in records)
+        cache_write = sum(record.get("cache_write_tokens") or 0 for record in records)
+        if cache_read or cache_write:
+            print(f"  prompt cache read/write: {cache_read}/{cache_write}")
@@ -1,5 +1,16 @@
-from typing import Literal
+from pathlib import Path
+from typing import Literal, Optional
 
+# This provides the models ask knows about: their abbreviations for -m, provider,
+# context window and capabilities. The built-in models below can be extended or
+# overridden in ~/.gpt_cli/models.toml (see load_models_config), e.g. to add a
+# model served locally by llama.cpp or vLLM. Everything is kept in dicts keyed by
+# model name or abbreviation, so each lookup is a single dict access.
+
+MODELS_CONFIG_PATHNAME = "~/.gpt_cli/models.toml"
+
+# "local" is any server speaking the OpenAI API at a model's base_url
+PROVIDERS = ("anthropic", "openai", "google", "xai", "local")
 
 # OpenAI
 GPT_41_MODEL_NAME = "gpt-4.1-2025-04-14"
@@ -38,12 +49,61 @@ XAI_MODELS = [GROK_3_MODEL_NAME, GROK_3_MINI_MODEL_NAME, GROK_4_MODEL_NAME]
 
 DEFAULT_MODEL_NAME = CLAUDE_4_OPUS_MODEL_NAME
 
+MODEL_NAME_TO_PROVIDER = {
+    **{model_name: "openai" for model_name in OPENAI_MODELS},
+    **{model_name: "anthropic" for model_name in ANTHROPIC_MODELS},
+    **{model_name: "google" for model_name in GOOGLE_MODELS},
+    **{model_name: "xai" for model_name in XAI_MODELS},
+}
+
+# Models only served by the legacy completions API, and models that can't stream
+LEGACY_MODELS = {GPT_4_BASE}
+NO_STREAMING_MODELS = set()
+
+# Where to send a model's requests and which environment variable holds its API
+# key, for models that don't use their provider's defaults (see providers.get_client)
+MODEL_NAME_TO_BASE_URL = {}
+MODEL_NAME_TO_API_KEY_ENV_VAR = {}
+
+# Context window sizes, in tokens
+MODEL_NAME_TO_CONTEXT_LIMIT = {
+    GPT_41_MODEL_NAME: 1_047_576,
+    O4_MINI_MODEL_NAME: 200_000,
+    O3_MODEL_NAME: 200_000,
+    GPT_4_BASE: 8_192,
+    GPT_5_MODEL_NAME: 400_000,
+    CLAUDE_4_OPUS_MODEL_NAME: 200_000,
+    CLAUDE_4_SONNET_MODEL_NAME: 200_000,
+    GEMINI_2_5_MODEL_NAME: 1_048_576,
+    GROK_3_MODEL_NAME: 131_072,
+    GROK_3_MINI_MODEL_NAME: 131_072,
+    GROK_4_MODEL_NAME: 256_000,
+}
+
+# Context window of a configured model that doesn't give one
+DEFAULT_CONTEXT_LIMIT = 8_192
+
+# Max tokens requested for a response (and so reserved out of the context window)
+MAX_OUTPUT_TOKENS = 4000
+
 
 def lacks_streaming_support(model_name: str) -> bool:
     assert not uses_legacy_completions(
         model_name
     ), f"Shouldn't be checking this for legacy model {model_name} -- shouldn't be using chat completions API"
-    return False
+    return model_name in NO_STREAMING_MODELS
+
+
+def get_context_limit(model_name: str) -> int:
+    return MODEL_NAME_TO_CONTEXT_LIMIT[model_name]
+
+
+def estimate_token_count(text: str) -> int:
+    """
+    Estimate how many tokens text takes, using the rule of thumb of ~4 characters
+    per token. Providers tokenize differently, so this is only meant for budgeting.
+    """
+    return (len(text) + 3) // 4
 
 
 def is_reasoning_model(model_name: str) -> bool:
@@ -67,39 +127,215 @@ MODEL_NAME_TO_ABBREV = {
     GROK_4_MODEL_NAME: ["x", "grok"],
 }
 
-MODEL_NAME_TO_ABBREV_LEGEND = ", ".join(
-    [
-        f"{short_str_list} for {model_name}"
-        for model_name, short_str_list in MODEL_NAME_TO_ABBREV.items()
-    ]
-)
+ABBREV_TO_MODEL_NAME = {
+    abbrev: model_name
+    for model_name, short_str_list in MODEL_NAME_TO_ABBREV.items()
+    for abbrev in short_str_list
+}
+
+
+def model_abbrev_legend() -> str:
+    return ", ".join(
+        [
+            f"{short_str_list} for {model_name}"
+            for model_name, short_str_list in MODEL_NAME_TO_ABBREV.items()
+        ]
+    )
+
+
+# Where a request goes when its model is slow to answer or fails (see failover.py):
+# another provider's model of similar strength, so one provider's outage or
+# overload doesn't hold up both. Legacy completion models have no fallback.
+MODEL_NAME_TO_FALLBACK = {
+    GPT_41_MODEL_NAME: CLAUDE_4_SONNET_MODEL_NAME,
+    O4_MINI_MODEL_NAME: CLAUDE_4_SONNET_MODEL_NAME,
+    O3_MODEL_NAME: CLAUDE_4_OPUS_MODEL_NAME,
+    GPT_5_MODEL_NAME: CLAUDE_4_OPUS_MODEL_NAME,
+    CLAUDE_4_OPUS_MODEL_NAME: GPT_5_MODEL_NAME,
+    CLAUDE_4_SONNET_MODEL_NAME: GPT_41_MODEL_NAME,
+    GEMINI_2_5_MODEL_NAME: CLAUDE_4_OPUS_MODEL_NAME,
+    GROK_3_MODEL_NAME: GPT_41_MODEL_NAME,
+    GROK_3_MINI_MODEL_NAME: GPT_41_MODEL_NAME,
+    GROK_4_MODEL_NAME: CLAUDE_4_OPUS_MODEL_NAME,
+}
+
+
+def get_fallback_model(
+    model_name: str, fallback_model_name: Optional[str] = None
+) -> Optional[str]:
+    """
+    Return the fallback for model_name: fallback_model_name if given, otherwise
+    the default one. None if there is none, or it couldn't continue the same
+    conversation (it is model_name itself, or only one of them is a legacy model).
+    """
+    if fallback_model_name is None:
+        fallback_model_name = MODEL_NAME_TO_FALLBACK.get(model_name)
+    if fallback_model_name is None or fallback_model_name == model_name:
+        return None
+    if uses_legacy_completions(fallback_model_name) != uses_legacy_completions(
+        model_name
+    ):
+        return None
+    return fallback_model_name
 
 
 def extract_model_name(model_short_str):
     """
     Extract the model name from a string input which was inputted via command line.
     """
-    for model_name, short_str_list in MODEL_NAME_TO_ABBREV.items():
-        if model_short_str in short_str_list or model_short_str == model_name:
-            return model_name
-    else:
-        raise NotImplementedError(f"Can't recognize model name {model_short_str}")
+    if model_short_str in MODEL_NAME_TO_PROVIDER:
+        return model_short_str
+    try:
+        return ABBREV_TO_MODEL_NAME[model_short_str]
+    except KeyError:
+        raise NotImplementedError(
+            f"Can't recognize model name {model_short_str}"
+        ) from None
 
 
 def model_name_to_provider(
     model_name: str,
-) -> Literal["anthropic", "openai", "google", "xai"]:
-    if model_name in ANTHROPIC_MODELS:
-        return "anthropic"
-    elif model_name in OPENAI_MODELS:
-        return "openai"
-    elif model_name in GOOGLE_MODELS:
-        return "google"
-    elif model_name in XAI_MODELS:
-        return "xai"
-    else:
-        raise NotImplementedError(f"unrecognized {model_name}")
+) -> Literal["anthropic", "openai", "google", "xai", "local"]:
+    try:
+        return MODEL_NAME_TO_PROVIDER[model_name]
+    except KeyError:
+        raise NotImplementedError(f"unrecognized {model_name}") from None
 
 
 def uses_legacy_completions(model_name: str) -> bool:
-    return model_name in [GPT_4_BASE]
+    return model_name in LEGACY_MODELS
+
+
+class ModelConfigError(Exception):
+    pass
+
+
+# Setting in models.toml -> the type its value must have
+MODEL_SETTINGS = {
+    "provider": str,
+    "abbrevs": list,
+    "base_url": str,
+    "api_key_env": str,
+    "context_limit": int,
+    "streaming": bool,
+    "legacy": bool,
+    "fallback": str,
+}
+
+
+def register_model(
+    model_name: str,
+    provider: Optional[str] = None,
+    abbrevs=(),
+    base_url: Optional[str] = None,
+    api_key_env: Optional[str] = None,
+    context_limit: Optional[int] = None,
+    streaming: Optional[bool] = None,
+    legacy: Optional[bool] = None,
+):
+    """
+    Add a model, or change the settings given for a known one (settings left as
+    None keep their current value). An abbreviation already used for another
+    model is taken over by this one. Raises ModelConfigError for invalid settings.
+    """
+    if provider is None:
+        if model_name not in MODEL_NAME_TO_PROVIDER:
+            raise ModelConfigError(f"{model_name}: a new model needs a provider")
+        provider = MODEL_NAME_TO_PROVIDER[model_name]
+    if provider not in PROVIDERS:
+        raise ModelConfigError(
+            f"{model_name}: provider must be one of {', '.join(PROVIDERS)}, not {provider!r}"
+        )
+    if base_url is None:
+        base_url = MODEL_NAME_TO_BASE_URL.get(model_name)
+    if provider == "local" and base_url is None:
+        raise ModelConfigError(f"{model_name}: a local model needs a base_url")
+    if context_limit is not None and context_limit <= 0:
+        raise ModelConfigError(f"{model_name}: context_limit must be positive")
+    if not all(isinstance(abbrev, str) for abbrev in abbrevs):
+        raise ModelConfigError(f"{model_name}: abbrevs must be strings")
+
+    MODEL_NAME_TO_PROVIDER[model_name] = provider
+    if base_url is not None:
+        MODEL_NAME_TO_BASE_URL[model_name] = base_url
+    if api_key_env is not None:
+        MODEL_NAME_TO_API_KEY_ENV_VAR[model_name] = api_key_env
+    if context_limit is not None:
+        MODEL_NAME_TO_CONTEXT_LIMIT[model_name] = context_limit
+    else:
+        MODEL_NAME_TO_CONTEXT_LIMIT.setdefault(model_name, DEFAULT_CONTEXT_LIMIT)
+    if streaming is not None:
+        (NO_STREAMING_MODELS.discard if streaming else NO_STREAMING_MODELS.add)(
+            model_name
+        )
+    if legacy is not None:
+        (LEGACY_MODELS.add if legacy else LEGACY_MODELS.discard)(model_name)
+
+    short_str_list = MODEL_NAME_TO_ABBREV.setdefault(model_name, [])
+    for abbrev in abbrevs:
+        previous = ABBREV_TO_MODEL_NAME.get(abbrev)
+        if previous == model_name:
+            continue
+        if previous is not None:
+            MODEL_NAME_TO_ABBREV[previous].remove(abbrev)
+        ABBREV_TO_MODEL_NAME[abbrev] = model_name
+        short_str_list.append(abbrev)
+
+
+def load_models_config(pathname=MODELS_CONFIG_PATHNAME):
+    """
+    Register the models in the TOML file at pathname, if there is one. Each model
+    is a [models."<name>"] table of MODEL_SETTINGS, and a top-level default_model
+    replaces the default for -m; fallbacks and default_model may be abbreviations.
+    Raises ModelConfigError if the file is malformed.
+    """
+    global DEFAULT_MODEL_NAME
+
+    path = Path(pathname).expanduser()
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    # Only paid for by those who have a config
+    import tomllib
+
+    with f:
+        try:
+            config = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ModelConfigError(f"{path}: {e}") from None
+
+    models = config.get("models", {})
+    if not isinstance(models, dict):
+        raise ModelConfigError(f"{path}: models must be a table")
+    fallbacks = {}
+    try:
+        for model_name, settings in models.items():
+            if not isinstance(settings, dict):
+                raise ModelConfigError(f"{model_name}: expected a table of settings")
+            for key, value in settings.items():
+                if key not in MODEL_SETTINGS:
+                    raise ModelConfigError(f"{model_name}: unknown setting {key}")
+                # bool is a subclass of int, but not a valid context_limit
+                if not isinstance(value, MODEL_SETTINGS[key]) or (
+                    isinstance(value, bool) and MODEL_SETTINGS[key] is not bool
+                ):
+                    raise ModelConfigError(
+                        f"{model_name}: {key} must be of type {MODEL_SETTINGS[key].__name__}"
+                    )
+            settings = dict(settings)
+            if "fallback" in settings:
+                fallbacks[model_name] = settings.pop("fallback")
+            register_model(model_name, **settings)
+
+        # Resolved once every model is registered, so they can refer to each other
+        for model_name, fallback in fallbacks.items():
+            MODEL_NAME_TO_FALLBACK[model_name] = extract_model_name(fallback)
+        if "default_model" in config:
+            if not isinstance(config["default_model"], str):
+                raise ModelConfigError("default_model must be of type str")
+            DEFAULT_MODEL_NAME = extract_model_name(config["default_model"])
+    except ModelConfigError as e:
+        raise ModelConfigError(f"{path}: {e}") from None
+    except NotImplementedError as e:
+        raise ModelConfigError(f"{path}: {e}") from None
@@ -0,0 +1,203 @@
+import os
+import time
+
+from model_handling import (
+    MAX_OUTPUT_TOKENS,
+    MODEL_NAME_TO_ABBREV,
+    MODEL_NAME_TO_API_KEY_ENV_VAR,
+    MODEL_NAME_TO_BASE_URL,
+    lacks_streaming_support,
+    uses_legacy_completions,
+)
+
+# This provides one client constructor and one streaming call per provider.
+# Provider SDKs are imported inside these functions, so an invocation only pays
+# the import cost of the provider it actually talks to. "local" models (see
+# models.toml in model_handling.py) go through the OpenAI client, at their own
+# base_url.
+
+# Point a provider at another server, e.g. a local one from benchmarks/mock_servers.py
+BASE_URL_ENV_VARS = {
+    "anthropic": "ANTHROPIC_BASE_URL",
+    "google": "GOOGLE_BASE_URL",
+    "openai": "OPENAI_BASE_URL",
+    "xai": "XAI_BASE_URL",
+}
+
+# Local servers rarely check the API key, but the OpenAI client insists on one
+LOCAL_PLACEHOLDER_API_KEY = "local"
+
+OPENAI_COMPATIBLE_PROVIDERS = ("openai", "xai", "local")
+
+
+def get_client(provider, model_name):
+    # A base_url configured for the model itself wins over the provider-wide one
+    base_url = MODEL_NAME_TO_BASE_URL.get(model_name)
+    if base_url is None and provider in BASE_URL_ENV_VARS:
+        base_url = os.getenv(BASE_URL_ENV_VARS[provider])
+    api_key_env_var = MODEL_NAME_TO_API_KEY_ENV_VAR.get(model_name)
+
+    if provider == "anthropic":
+        import anthropic
+
+        return anthropic.Anthropic(
+            api_key=os.getenv(api_key_env_var or "ANTHROPIC_API_KEY"),
+            base_url=base_url,
+        )
+
+    elif provider == "google":
+        from google import genai
+
+        return genai.Client(
+            api_key=os.getenv(api_key_env_var or "GOOGLE_API_KEY"),
+            http_options={"base_url": base_url} if base_url else None,
+        )
+
+    elif provider in OPENAI_COMPATIBLE_PROVIDERS:
+        from openai import OpenAI
+
+        if provider == "xai":
+            base_url = base_url or "https://api.x.ai/v1"
+
+        if api_key_env_var is not None:
+            api_key = os.getenv(api_key_env_var)
+        elif provider == "local":
+            api_key = None
+        elif provider == "xai":
+            api_key = os.getenv("XAI_API_KEY")
+        else:
+            # first detect if there's a model-specific API key
+            model_abbrevs = MODEL_NAME_TO_ABBREV.get(model_name, [])
+            for model_abbrev in model_abbrevs:
+                env_var = f"OPENAI_API_KEY_{model_abbrev}"
+                if os.getenv(env_var):
+                    api_key = os.getenv(env_var)
+                    break
+            else:
+                api_key = os.getenv("OPENAI_API_KEY_CLI")
+
+        if provider == "local" and api_key is None:
+            api_key = LOCAL_PLACEHOLDER_API_KEY
+
+        return OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+        )
+
+    else:
+        raise NotImplementedError(f"unrecognized provider {provider}")
+
+
+def stream_response(client, provider, model_name, history, optional_args, usage=None):
+    """
+    Send history to the model and yield the response text in chunks as it arrives.
+    Models without streaming support yield their whole response as one chunk.
+    If a usage dict is given, the provider-reported input_tokens and output_tokens
+    are stored in it once the stream has finished, along with cache_read_tokens
+    and cache_write_tokens: the part of the input served from (or written to) the
+    provider's prompt cache. usage["request_sent"] is when the first request
+    went out (by time.perf_counter), after the SDK was imported and the client
+    made; retries leave it as it is.
+    """
+    if usage is None:
+        usage = {}
+    usage.setdefault("request_sent", time.perf_counter())
+
+    if provider == "anthropic":
+        system_prompt, messages = history.get_message_history(platform="anthropic")
+
+        if system_prompt is None:
+            messages_dict = {"messages": messages}
+        else:
+            messages_dict = {"system": system_prompt, "messages": messages}
+
+        with client.messages.stream(
+            model=model_name,
+            max_tokens=MAX_OUTPUT_TOKENS,
+            **messages_dict,
+            **optional_args,
+        ) as stream:
+            yield from stream.text_stream
+            final_usage = stream.get_final_message().usage
+            usage["input_tokens"] = final_usage.input_tokens
+            usage["output_tokens"] = final_usage.output_tokens
+            usage["cache_read_tokens"] = final_usage.cache_read_input_tokens
+            usage["cache_write_tokens"] = final_usage.cache_creation_input_tokens
+
+    elif provider == "google":
+        system_prompt, messages = history.get_message_history(platform="google")
+
+        completion = client.models.generate_content_stream(
+            model=model_name,
+            contents=messages,
+        )
+
+        for chunk in completion:
+            if chunk.text:
+                yield chunk.text
+            if chunk.usage_metadata is not None:
+                usage["input_tokens"] = chunk.usage_metadata.prompt_token_count
+                usage["output_tokens"] = chunk.usage_metadata.candidates_token_count
+                usage["cache_read_tokens"] = (
+                    chunk.usage_metadata.cached_content_token_count
+                )
+
+    elif provider in OPENAI_COMPATIBLE_PROVIDERS:
+        if uses_legacy_completions(model_name):
+            completion = client.completions.create(
+                model=model_name,
+                prompt=history.get_message_history(platform="legacy"),
+                stream=True,
+                stream_options={"include_usage": True},
+                max_tokens=MAX_OUTPUT_TOKENS,
+                **optional_args,
+            )  # type: ignore
+
+            for chunk in completion:
+                # The final chunk carries only the usage
+                if chunk.usage is not None:
+                    usage["input_tokens"] = chunk.usage.prompt_tokens
+                    usage["output_tokens"] = chunk.usage.completion_tokens
+                if chunk.choices:
+                    yield chunk.choices[0].text
+
+        elif lacks_streaming_support(model_name):
+            completion = client.chat.completions.create(
+                model=model_name,
+                messages=history.get_message_history(platform="openai"),
+                **optional_args,
+            )  # type: ignore
+
+            _record_openai_usage(completion.usage, usage)
+            yield completion.choices[0].message.content
+
+        else:
+            completion = client.chat.completions.create(
+                model=model_name,
+                messages=history.get_message_history(platform="openai"),
+                stream=True,
+                stream_options={"include_usage": True},
+                **optional_args,
+            )  # type: ignore
+
+            for chunk in completion:
+                # The final chunk carries only the usage
+                if chunk.usage is not None:
+                    _record_openai_usage(chunk.usage, usage)
+                if not chunk.choices:
+                    continue
+                chunk_message = chunk.choices[0].delta
+                if chunk_message.content is not None:
+                    yield chunk_message.content
+
+    else:
+        raise NotImplementedError(f"unrecognized provider {provider}")
+
+
+def _record_openai_usage(completion_usage, usage):
+    usage["input_tokens"] = completion_usage.prompt_tokens
+    usage["output_tokens"] = completion_usage.completion_tokens
+    # OpenAI caches long prompt prefixes automatically; it doesn't report writes
+    details = completion_usage.prompt_tokens_details
+    if details is not None:
+        usage["cache_read_tokens"] = details.cached_tokens
@@ -0,0 +1,51 @@
+import os
+import sys
+
+# This provides --raw output: the response written to stdout exactly as it
+# streams in, with no markdown rendering (and without importing rich). It is
+# used automatically when stdout isn't a terminal, e.g. `ask "..." | tee out.md`.
+
+
+def discard_output(out):
+    """
+    Send whatever is still written to out to devnull, once whatever was reading
+    it has gone (e.g. `ask "..." | head`). Otherwise each later write, and
+    Python's own flush at exit, raises BrokenPipeError again.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, out.fileno())
+    os.close(devnull)
+
+
+def write_completion(completion, out=None):
+    """
+    Write a streamed response to out (stdout by default) unchanged, and return
+    (response, interrupted) like rendering.render_completion. Output is flushed
+    at line ends rather than after every chunk, so whatever reads the pipe sees
+    each line as soon as it is complete. If the reader goes away, the response
+    stops there, as if interrupted.
+    """
+    out = sys.stdout if out is None else out
+    chunks = []
+    interrupted = False
+    try:
+        for text in completion:
+            chunks.append(text)
+            out.write(text)
+            if "\n" in text:
+                out.flush()
+    except KeyboardInterrupt:
+        interrupted = True
+        # Kept out of the output, which may be going to a file
+        print("<KeyboardInterrupt>", file=sys.stderr, flush=True)
+    except BrokenPipeError:
+        interrupted = True
+        discard_output(out)
+    finally:
+        # Also when the reader has gone, so the request ends now and is still
+        # recorded by metrics.timed
+        completion.close()
+    if chunks and not chunks[-1].endswith("\n"):
+        out.write("\n")
+    out.flush()
+    return "".join(chunks), interrupted
@@ -0,0 +1,242 @@
+import fcntl
+import io
+import math
+import os
+import re
+import zlib
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+
+import attachments
+
+# This provides --recall: earlier turns that resemble the prompt, found offline
+# and attached to it. Each saved turn (prompt and response) is turned into a
+# fixed-size vector by hashing its words, with no model or vocabulary needed,
+# and appended to a matrix in ~/.gpt_cli/recall/ as it is saved (see
+# conversation.save_turn). Finding the best matches is then one matrix-vector
+# product over the memory-mapped matrix. The index is built from the whole
+# history the first time --recall is used, and only kept up to date after that.
+
+RECALL_PATHNAME = "~/.gpt_cli/recall/"
+# One row of DIMENSIONS float32s per turn
+VECTORS_FILENAME = "vectors.f32"
+# One row of (conversation ID, turn) int32s per turn, in the same order
+ROWS_FILENAME = "rows.i32"
+LOCK_FILENAME = "lock"
+
+DIMENSIONS = 512
+VECTOR_BYTES = DIMENSIONS * 4
+ROW_BYTES = 2 * 4
+
+RECALL_NAME = "<recall>"
+# Cosine similarity below which a turn isn't worth attaching
+MIN_SCORE = 0.1
+# How much of a recalled turn is attached
+MAX_PROMPT_CHARS = 1000
+MAX_RESPONSE_CHARS = 3000
+
+WORD_PATTERN = re.compile(r"\w\w+")
+STOPWORDS = frozenset("""
+    an and are as at be but by can do does for from has have how if in is it its
+    me my no not of on or so than that the their them then there these they this
+    to was we what when which who why will with would you your
+    """.split())
+
+
+def vectorize(text):
+    """
+    Return text as a unit-length array of DIMENSIONS floats: each word (minus
+    stopwords) is hashed to a dimension and a sign, and weighted 1 + log(count).
+    """
+    counts = {}
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word not in STOPWORDS:
+            counts[word] = counts.get(word, 0) + 1
+    vector = [0.0] * DIMENSIONS
+    for word, count in counts.items():
+        h = zlib.crc32(word.encode())
+        weight = 1.0 + math.log(count)
+        # The sign keeps words that collide from adding up in expectation
+        vector[h % DIMENSIONS] += weight if h & 0x80000000 else -weight
+    norm = math.sqrt(sum(x * x for x in vector))
+    return array("f", [x / norm for x in vector] if norm else vector)
+
+
+def turn_text(user_prompt, response):
+    return f"{user_prompt}\n{response}"
+
+
+@contextmanager
+def _locked(directory):
+    # Held while the index is appended to or rebuilt, so rows stay in step
+    with open(directory / LOCK_FILENAME, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _row_count(directory):
+    """
+    Return how many complete rows both index files have, or None if there is no
+    index.
+    """
+    try:
+        vectors_size = os.path.getsize(directory / VECTORS_FILENAME)
+        rows_size = os.path.getsize(directory / ROWS_FILENAME)
+    except FileNotFoundError:
+        return None
+    return min(vectors_size // VECTOR_BYTES, rows_size // ROW_BYTES)
+
+
+def index_turn(conv_id, turn, text, pathname=RECALL_PATHNAME):
+    """
+    Add turn number `turn` of conversation conv_id to the index, if there is one
+    (otherwise it is indexed along with everything else when the index is built).
+    """
+    directory = Path(pathname).expanduser()
+    if _row_count(directory) is None:
+        return
+    vector = vectorize(text)
+    with _locked(directory):
+        n = _row_count(directory)
+        # Drop what a writer that died halfway through left behind
+        os.truncate(directory / VECTORS_FILENAME, n * VECTOR_BYTES)
+        os.truncate(directory / ROWS_FILENAME, n * ROW_BYTES)
+        with open(directory / VECTORS_FILENAME, "ab") as f:
+            vector.tofile(f)
+        with open(directory / ROWS_FILENAME, "ab") as f:
+            array("i", [conv_id, turn]).tofile(f)
+
+
+def _turns(history):
+    """
+    Yield (turn, user message, response or None) for each turn of history, turns
+    counting from 1.
+    """
+    lines = history.get_message_history()
+    turn = 0
+    for i, line in enumerate(lines):
+        if line.role == "user":
+            turn += 1
+            following = lines[i + 1] if i + 1 < len(lines) else None
+            if following is not None and following.role != "assistant":
+                following = None
+            yield turn, line, following
+
+
+def build_index(store, pathname=RECALL_PATHNAME):
+    """
+    Index every turn in store, replacing any existing index. A branch's turns
+    shared with its parent are only indexed under the parent.
+    """
+    directory = Path(pathname).expanduser()
+    directory.mkdir(parents=True, exist_ok=True)
+    with _locked(directory):
+        forks = store.get_forks()
+        vectors = array("f")
+        rows = array("i")
+        for conv_id in range(len(store.get_chat_names())):
+            shared_turns = forks[conv_id][1] if conv_id in forks else 0
+            for turn, line, response in _turns(store.get_history(conv_id)):
+                if turn <= shared_turns:
+                    continue
+                vectors.extend(
+                    vectorize(
+                        turn_text(line.content, response.content if response else "")
+                    )
+                )
+                rows.extend([conv_id, turn])
+        for filename, data in [(VECTORS_FILENAME, vectors), (ROWS_FILENAME, rows)]:
+            tmp_path = directory / f"{filename}.tmp{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                data.tofile(f)
+            os.replace(tmp_path, directory / filename)
+
+
+def search(query, limit, pathname=RECALL_PATHNAME):
+    """
+    Return up to limit (score, conversation ID, turn) for the indexed turns most
+    similar to query, best first, leaving out those scoring below MIN_SCORE.
+    """
+    import numpy as np
+
+    directory = Path(pathname).expanduser()
+    n = _row_count(directory)
+    if not n or limit <= 0:
+        return []
+    vectors = np.memmap(
+        directory / VECTORS_FILENAME, dtype=np.float32, mode="r", shape=(n, DIMENSIONS)
+    )
+    rows = np.memmap(directory / ROWS_FILENAME, dtype=np.int32, mode="r", shape=(n, 2))
+    # Rows are unit length, so these are cosine similarities
+    scores = vectors @ np.frombuffer(vectorize(query), dtype=np.float32)
+    limit = min(limit, n)
+    best = np.argpartition(scores, n - limit)[n - limit :]
+    best = best[np.argsort(-scores[best])]
+    return [
+        (float(scores[i]), int(rows[i, 0]), int(rows[i, 1]))
+        for i in best
+        if scores[i] >= MIN_SCORE
+    ]
+
+
+def recall(store, query, k, current_history=None, pathname=RECALL_PATHNAME):
+    """
+    Return up to k (conversation ID, turn, prompt, response) for the saved turns
+    most similar to query, best first, building the index first if there is
+    none. Turns whose prompt is already in current_history are left out.
+    """
+    if _row_count(Path(pathname).expanduser()) is None:
+        build_index(store, pathname)
+    in_context = set()
+    if current_history is not None:
+        in_context = {
+            line.content
+            for line in current_history.get_message_history()
+            if line.role == "user"
+        }
+
+    recalled = []
+    # Room for matches that are left out
+    for _, conv_id, turn in search(query, 4 * k + len(in_context), pathname):
+        try:
+            history = store.get_history(conv_id)
+        except IndexError:
+            continue
+        for number, line, response in _turns(history):
+            if number == turn:
+                break
+        else:
+            continue
+        if line.content in in_context:
+            continue
+        in_context.add(line.content)
+        recalled.append(
+            (conv_id, turn, line.content, response.content if response else "")
+        )
+        if len(recalled) == k:
+            break
+    return recalled
+
+
+def _shorten(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars] + " [...]"
+
+
+def attach(recalled):
+    """
+    Return the recalled turns as an attachment reference, stored like an
+    attached file called RECALL_NAME.
+    """
+    parts = ["Possibly relevant turns from earlier conversations:"]
+    for conv_id, turn, user_prompt, response in recalled:
+        parts.append(
+            f"[conversation {conv_id}, turn {turn}]\n"
+            f"User: {_shorten(user_prompt, MAX_PROMPT_CHARS)}\n"
+            f"Assistant: {_shorten(response, MAX_RESPONSE_CHARS)}"
+        )
+    text = "\n\n".join(parts)
+    return attachments.attach_stream(io.BytesIO(text.encode()), name=RECALL_NAME)
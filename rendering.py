@@ -0,0 +1,264 @@
+import re
+
+from rich.console import Console, Group
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.segment import Segment
+from rich.text import Text
+
+# This provides rendering of streamed markdown responses.
+
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# Inside a list item, fences are indented along with the rest of the item
+INDENTED_FENCE_RE = re.compile(r"^\s*(`{3,}|~{3,})")
+HEADING_RE = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+LIST_ITEM_RE = re.compile(r"^([-*+]|\d+[.)])(\s|$)")
+
+
+def _list_kind(line):
+    match = LIST_ITEM_RE.match(line)
+    if match is None:
+        return None
+    return "bullet" if match.group(1) in "-*+" else "ordered"
+
+
+class _Block:
+    """
+    A markdown block rendered on its own. rich starts a document that opens with a
+    list with an empty line; that is dropped here, since MarkdownStream places the
+    gaps between blocks itself.
+    """
+
+    def __init__(self, text):
+        self.markdown = Markdown(text)
+
+    def __rich_console__(self, console, options):
+        lines = console.render_lines(self.markdown, options, pad=False)
+        while lines and Segment.get_line_length(lines[0]) == 0:
+            lines.pop(0)
+        for line in lines:
+            yield from line
+            yield Segment.line()
+
+
+class _LaidOutBlock(_Block):
+    """
+    A finished _Block that is shown again on every refresh (in a FanOutDisplay
+    panel), so it is laid out once per width rather than each time.
+    """
+
+    def __init__(self, text):
+        super().__init__(text)
+        self._segments = {}
+
+    def __rich_console__(self, console, options):
+        if options.max_width not in self._segments:
+            self._segments[options.max_width] = list(
+                super().__rich_console__(console, options)
+            )
+        yield from self._segments[options.max_width]
+
+
+class MarkdownStream:
+    """
+    Renders markdown as it streams in. Each finished block (paragraph, heading,
+    closed code fence, top-level list item) is printed to the terminal once;
+    only the trailing open block is kept in the live display and re-rendered,
+    so the cost of a refresh doesn't grow with the length of the response.
+    Without live, nothing is printed: finished blocks are kept in `finished`
+    for a caller that shows them itself, as FanOutDisplay does.
+    """
+
+    def __init__(self, console=None, refresh_per_second=10, live=True):
+        self.console = console if console is not None else Console()
+        self.live = None
+        if live:
+            self.live = Live(
+                self, console=self.console, refresh_per_second=refresh_per_second
+            )
+        self.finished = []
+        self._partial = []  # chunks of the current unfinished line
+        self._block = []  # finished lines of the open block
+        self._fence = None  # opening marker of the code fence we're inside, if any
+        self._committed_any = False
+        self._last_list_kind = None
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Stopping does a final refresh, which leaves the open block on screen
+        self.live.stop()
+
+    def feed(self, text):
+        lines = text.split("\n")
+        self._partial.append(lines[0])
+        for line in lines[1:]:
+            self._end_line("".join(self._partial))
+            self._partial = [line]
+
+    def _in_list_item(self):
+        return bool(self._block) and LIST_ITEM_RE.match(self._block[0]) is not None
+
+    def _end_line(self, line):
+        if self._fence is not None:
+            self._block.append(line)
+            stripped = line.strip()
+            if (
+                stripped
+                and set(stripped) == {self._fence[0]}
+                and len(stripped) >= len(self._fence)
+            ):
+                self._fence = None
+                # A fence in a list item is only part of it
+                if not self._in_list_item():
+                    self._commit()
+            return
+
+        if self._in_list_item() and not LIST_ITEM_RE.match(line):
+            # Blank lines, indented lines (further paragraphs, nested lists,
+            # fences) and lines continuing the item's text all belong to it
+            continues = (
+                not line.strip()
+                or line[0] in " \t"
+                or (
+                    self._block[-1].strip()
+                    and not FENCE_RE.match(line)
+                    and not HEADING_RE.match(line)
+                )
+            )
+            if continues:
+                fence = INDENTED_FENCE_RE.match(line)
+                if fence:
+                    self._fence = fence.group(1)
+                self._block.append(line)
+                return
+            self._commit()
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            self._commit()
+            self._block.append(line)
+            self._fence = fence.group(1)
+        elif not line.strip():
+            self._commit()
+        elif HEADING_RE.match(line):
+            self._commit()
+            self._block.append(line)
+            self._commit()
+        else:
+            if LIST_ITEM_RE.match(line):
+                self._commit()
+            self._block.append(line)
+
+    def _needs_gap(self, first_line):
+        # rich puts a blank line between top-level blocks, but not between the items of a list
+        list_kind = _list_kind(first_line)
+        return self._committed_any and (
+            list_kind is None or list_kind != self._last_list_kind
+        )
+
+    def _commit(self):
+        # A list item keeps the blank lines after it until it is known to end
+        while self._block and not self._block[-1].strip():
+            self._block.pop()
+        if not self._block:
+            return
+        block = self._block
+        # Clear the open block before printing, so the refresh triggered by
+        # printing doesn't show the block twice
+        self._block = []
+        gap = self._needs_gap(block[0])
+        if self.live is None:
+            if gap:
+                self.finished.append(Text(""))
+            self.finished.append(_LaidOutBlock("\n".join(block)))
+        else:
+            if gap:
+                self.live.console.print()
+            self.live.console.print(_Block("\n".join(block)))
+        self._committed_any = True
+        self._last_list_kind = _list_kind(block[0])
+
+    def __rich__(self):
+        lines = self._block + ["".join(self._partial)]
+        tail = "\n".join(lines)
+        if not tail.strip():
+            return Text("")
+        block = _Block(tail)
+        if self._needs_gap(lines[0]):
+            return Group(Text(""), block)
+        return block
+
+
+def render_completion(completion, plain=False):
+    """
+    Print a streamed response as it arrives, as markdown unless plain, and return
+    (response, interrupted). Ctrl-C stops the stream but keeps what has arrived.
+    """
+    chunks = []
+    interrupted = False
+    try:
+        if plain:
+            for text in completion:
+                chunks.append(text)
+                print(text, end="", flush=True)
+        else:
+            with MarkdownStream() as markdown_stream:
+                for text in completion:
+                    chunks.append(text)
+                    markdown_stream.feed(text)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("<KeyboardInterrupt>", flush=True)
+    else:
+        print()
+    finally:
+        # After Ctrl-C the stream is left half read: close the request now
+        completion.close()
+    return "".join(chunks), interrupted
+
+
+class FanOutDisplay:
+    """
+    Live display of several responses streaming at once, one panel per model.
+    At each refresh, the chunks collected since the last one are fed to that
+    panel's MarkdownStream, so only its open block is rendered again.
+    """
+
+    def __init__(self, chunks, errors, console=None, refresh_per_second=10):
+        self.chunks = chunks
+        self.errors = errors
+        self.console = console if console is not None else Console()
+        self.streams = {
+            model_name: MarkdownStream(self.console, live=False)
+            for model_name in chunks
+        }
+        self.fed = {model_name: 0 for model_name in chunks}
+        self.live = Live(
+            self, console=self.console, refresh_per_second=refresh_per_second
+        )
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.live.stop()
+
+    def __rich__(self):
+        from rich.panel import Panel
+
+        panels = []
+        for model_name, chunks in self.chunks.items():
+            # Other threads may be appending to chunks
+            new = chunks[self.fed[model_name] :]
+            self.fed[model_name] += len(new)
+            stream = self.streams[model_name]
+            stream.feed("".join(new))
+            body = Group(*stream.finished, stream)
+            if model_name in self.errors:
+                body = Group(body, Text(self.errors[model_name], style="red"))
+            panels.append(Panel(body, title=model_name, title_align="left"))
+        return Group(*panels)
@@ -0,0 +1,260 @@
+import shlex
+import sys
+
+import attachments
+import conversation
+import failover
+import metrics
+import providers
+import recall
+from model_handling import (
+    extract_model_name,
+    get_fallback_model,
+    lacks_streaming_support,
+    model_name_to_provider,
+    uses_legacy_completions,
+)
+
+# This provides `ask -i`: a multi-turn session in one process, which keeps one
+# in-memory History and one client per model, and saves each turn as it ends.
+
+PROMPT = ">>> "
+CONTINUATION_PROMPT = "... "
+
+HELP = """Commands:
+  /model NAME      switch model (names as for -m)
+  /temp [T]        set the temperature, or go back to the default without T
+  /attach PATH...  attach files (paths or globs) to the next prompt
+  /help            show this message
+  /quit            end the session (as does Ctrl-D)
+End a line with \\ to continue the prompt on the next line."""
+
+
+class Session:
+    def __init__(
+        self,
+        store,
+        current_history,
+        reply_index,
+        model_name,
+        optional_args,
+        private=False,
+        context_strategy="drop_oldest",
+        max_context=None,
+        use_cache=False,
+        refresh=False,
+        retries=failover.DEFAULT_RETRIES,
+        fallback_model_name=None,
+        hedge_after=None,
+        raw=False,
+        recall=None,
+    ):
+        self.store = store
+        self.current_history = current_history
+        self.reply_index = reply_index
+        self.model_name = model_name
+        self.optional_args = optional_args
+        self.private = private
+        self.context_strategy = context_strategy
+        self.max_context = max_context
+        self.use_cache = use_cache
+        self.refresh = refresh
+        self.retries = retries
+        # None means each model's default fallback, so /model picks a fitting one
+        self.fallback_model_name = fallback_model_name
+        self.hedge_after = hedge_after
+        self.raw = raw
+        # Earlier turns to attach to each prompt (see recall.py)
+        self.recall = recall
+        self.clients = {}
+        self.attached = []
+        self.saved_conv_id = None
+
+    def get_client(self, provider, model_name):
+        key = (provider, model_name)
+        if key not in self.clients:
+            self.clients[key] = providers.get_client(provider, model_name)
+        return self.clients[key]
+
+    def run_command(self, line):
+        """
+        Handle a /command. Returns False when the session should end.
+        """
+        try:
+            name, *arguments = shlex.split(line)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return True
+        if name in ["/quit", "/exit"]:
+            return False
+        elif name == "/model" and len(arguments) == 1:
+            try:
+                model_name = extract_model_name(arguments[0])
+            except NotImplementedError as e:
+                print(e)
+                return True
+            if uses_legacy_completions(model_name) != self.current_history.is_legacy():
+                print("Can't switch between chat and legacy completion models.")
+            else:
+                self.model_name = model_name
+                print(f"(now talking to {model_name})")
+        elif name == "/temp" and len(arguments) <= 1:
+            if arguments:
+                try:
+                    self.optional_args["temperature"] = float(arguments[0])
+                except ValueError:
+                    print(f"Error: not a temperature: {arguments[0]}")
+            else:
+                self.optional_args.pop("temperature", None)
+        elif name == "/attach" and arguments:
+            try:
+                attached, skipped = attachments.attach(arguments)
+            except attachments.AttachmentError as e:
+                print(f"Error: {e}")
+                return True
+            for path in skipped:
+                print(f"(skipped binary file {path})")
+            self.attached.extend(attached)
+            names = ", ".join(attachment["name"] for attachment in self.attached)
+            print(f"(attached to the next prompt: {names})")
+        else:
+            print(HELP)
+        return True
+
+    def turn(self, user_prompt):
+        """
+        Send one prompt, render the response and save the turn.
+        """
+        model_name = self.model_name
+        provider = model_name_to_provider(model_name)
+        if self.recall:
+            recalled = recall.recall(
+                self.store, user_prompt, self.recall, self.current_history
+            )
+            if recalled:
+                self.attached.append(recall.attach(recalled))
+                print(
+                    f"(recalled {len(recalled)} earlier turn{'s' if len(recalled) > 1 else ''})"
+                )
+        self.current_history.append_user_message(user_prompt, self.attached)
+        self.attached = []
+
+        usage = {}
+        record = {}
+        turn_journal = None
+        try:
+            completion, _ = conversation.start_completion(
+                self.current_history,
+                model_name,
+                self.optional_args,
+                usage,
+                self.get_client,
+                context_strategy=self.context_strategy,
+                max_context=self.max_context,
+                use_cache=self.use_cache,
+                refresh=self.refresh,
+                retries=self.retries,
+                fallback_model_name=get_fallback_model(
+                    model_name, self.fallback_model_name
+                ),
+                hedge_after=self.hedge_after,
+            )
+            if not self.private:
+                turn_journal = conversation.open_journal(
+                    self.current_history, self.reply_index, model_name
+                )
+                completion = turn_journal.record(completion)
+            if self.raw:
+                from raw_output import write_completion
+
+                response, interrupted = write_completion(
+                    metrics.timed(completion, record, usage)
+                )
+            else:
+                from rendering import render_completion
+
+                response, interrupted = render_completion(
+                    metrics.timed(completion, record, usage),
+                    plain=uses_legacy_completions(model_name)
+                    or lacks_streaming_support(model_name),
+                )
+        except Exception as e:
+            # Keep the session (and what has been said so far) alive; the prompt
+            # can be sent again
+            if turn_journal is not None:
+                turn_journal.discard()
+            self.current_history.message_history = self.current_history.message_history[
+                :-1
+            ]
+            print(f"Error: {type(e).__name__}: {e}")
+            return
+        metrics.log_metrics(
+            metrics.finish_record(record, model_name, provider, usage, interrupted)
+        )
+
+        # A fallback model may have answered instead
+        answered_by = usage.get("model", model_name)
+        if answered_by != model_name:
+            print(f"(answered by {answered_by})")
+
+        if self.private:
+            self.current_history.append_response(response, answered_by)
+        else:
+            self.reply_index = self.saved_conv_id = conversation.save_turn(
+                self.store,
+                self.current_history,
+                self.reply_index,
+                user_prompt,
+                response,
+                answered_by,
+                usage.get("attempts"),
+            )
+            # Committed now, so nothing is lost if the session is killed
+            self.store.flush()
+            turn_journal.discard()
+
+
+def read_prompt():
+    """
+    Read one prompt, joining lines that end with a backslash. Raises EOFError at
+    the end of input.
+    """
+    lines = [input(PROMPT)]
+    while lines[-1].endswith("\\"):
+        lines[-1] = lines[-1][:-1]
+        lines.append(input(CONTINUATION_PROMPT))
+    return "\n".join(lines)
+
+
+def run(session, first_prompt=None):
+    try:
+        # Line editing and history for input(), where available
+        import readline  # noqa: F401
+    except ImportError:
+        pass
+
+    print(f"(talking to {session.model_name}; /help for commands, Ctrl-D to quit)")
+    if first_prompt is not None:
+        print(f"{PROMPT}{first_prompt}")
+        session.turn(first_prompt)
+
+    while True:
+        try:
+            line = read_prompt()
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            # Discards the line being typed, like a shell
+            print()
+            continue
+        if not line.strip():
+            continue
+        if line.startswith("/"):
+            if not session.run_command(line):
+                break
+        else:
+            session.turn(line)
+
+    if session.saved_conv_id is not None:
+        print(f"(saved as conversation {session.saved_conv_id})", file=sys.stderr)
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+# This provides the raw log of every request: one JSON object per line in
+# ~/.gpt_cli/log.jsonl, written in a single append per request. Once the log
+# grows past LOG_MAX_BYTES it is compressed into a timestamped segment
+# (log-YYYYMMDD-HHMMSS.ffffff.jsonl.gz) and a fresh log is started; only the newest
+# LOG_MAX_SEGMENTS segments are kept. read_log() streams through all of it.
+
+LOG_PATHNAME = "~/.gpt_cli/"
+LOG_FILENAME = "log.jsonl"
+LOG_SEGMENT_GLOB = "log-*.jsonl.gz"
+LOG_MAX_BYTES = 16 * 1024 * 1024
+LOG_MAX_SEGMENTS = 64
+
+
+def log_request(record, pathname=LOG_PATHNAME, filename=LOG_FILENAME):
+    """
+    Append record to the log as one line, rotating the log first if it's full.
+    """
+    path = Path(pathname).expanduser() / filename
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    try:
+        if path.stat().st_size + len(line) > LOG_MAX_BYTES:
+            rotate(pathname, filename)
+    except FileNotFoundError:
+        pass
+    # A single write to a file opened for appending, so concurrent writers
+    # (the daemon, batch workers, other invocations) don't interleave lines
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def rotate(pathname=LOG_PATHNAME, filename=LOG_FILENAME):
+    """
+    Compress the current log into a new segment and drop the oldest segments.
+    """
+    directory = Path(pathname).expanduser()
+    # Renaming first means only one of several concurrent rotations gets the file
+    claimed = directory / f"{filename}.rotating{os.getpid()}"
+    try:
+        os.replace(directory / filename, claimed)
+    except FileNotFoundError:
+        return
+
+    # Fixed-width timestamps down to the microsecond, so names sort by age
+    now = time.time()
+    timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+    segment = directory / f"log-{timestamp}.{int(now % 1 * 1e6):06d}.jsonl.gz"
+    with open(claimed, "rb") as src, gzip.open(segment, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    claimed.unlink()
+
+    for old_segment in _segments(directory)[:-LOG_MAX_SEGMENTS]:
+        old_segment.unlink(missing_ok=True)
+
+
+def _segments(directory):
+    # Oldest first; the names sort by creation time
+    return sorted(directory.glob(LOG_SEGMENT_GLOB))
+
+
+def read_log(since=None, pathname=LOG_PATHNAME, filename=LOG_FILENAME):
+    """
+    Yield the logged records, oldest first, from the compressed segments and
+    then the current log, one line at a time. If since (a Unix time) is given,
+    only records from then on are yielded.
+    """
+    directory = Path(pathname).expanduser()
+    files = [(gzip.open, segment) for segment in _segments(directory)]
+    files.append((open, directory / filename))
+    for opener, path in files:
+        try:
+            f = opener(path, "rt", encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # e.g. a line cut short by a crash
+                    continue
+                if since is None or record["time"] >= since:
+                    yield record
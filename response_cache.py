@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from model_handling import uses_legacy_completions
+
+# This provides an opt-in on-disk cache of responses. Entries are keyed by a hash
+# of the model name, the exact payload sent to the provider and the sampling
+# parameters. Entries older than CACHE_MAX_AGE_SECONDS are not served, and
+# entries are evicted least-recently-used first once the cache grows past
+# CACHE_MAX_BYTES (or once unused for CACHE_MAX_AGE_SECONDS).
+
+CACHE_PATHNAME = "~/.gpt_cli/cache/"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# Set to 1 to cache without passing --cache every time
+CACHE_ENV_VAR = "GPT_CLI_CACHE"
+
+
+def is_enabled(cache_flag, no_cache_flag):
+    if no_cache_flag:
+        return False
+    return cache_flag or os.getenv(CACHE_ENV_VAR) == "1"
+
+
+def payload_platform(provider, model_name):
+    if uses_legacy_completions(model_name):
+        return "legacy"
+    elif provider == "xai" or provider == "local":
+        return "openai"
+    else:
+        return provider
+
+
+def cache_key(model_name, provider, history, optional_args):
+    payload = history.get_message_history(
+        platform=payload_platform(provider, model_name)
+    )
+    normalized = json.dumps(
+        {"model": model_name, "payload": payload, "args": optional_args},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _entry_path(key, pathname=CACHE_PATHNAME):
+    return Path(pathname).expanduser() / key[:2] / f"{key}.json"
+
+
+def get(key, pathname=CACHE_PATHNAME):
+    path = _entry_path(key, pathname)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if time.time() - entry["created"] > CACHE_MAX_AGE_SECONDS:
+        path.unlink(missing_ok=True)
+        return None
+    # The modification time records the last use, for LRU eviction
+    os.utime(path)
+    return entry["response"]
+
+
+def put(key, response, model_name, pathname=CACHE_PATHNAME):
+    path = _entry_path(key, pathname)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {"model": model_name, "created": time.time(), "response": response}, f
+        )
+    os.replace(tmp_path, path)
+    evict(pathname)
+
+
+def evict(pathname=CACHE_PATHNAME, max_bytes=CACHE_MAX_BYTES):
+    """
+    Delete expired entries, then least recently used ones until under max_bytes.
+    """
+    entries = []
+    now = time.time()
+    for path in Path(pathname).expanduser().glob("*/*.json"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > CACHE_MAX_AGE_SECONDS:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def _replay(response):
+    yield response
+
+
+def _put_when_complete(completion, key, model_name):
+    chunks = []
+    for text in completion:
+        chunks.append(text)
+        yield text
+    # Only reached if the stream wasn't interrupted
+    put(key, "".join(chunks), model_name)
+
+
+def cached_completion(
+    model_name,
+    provider,
+    history,
+    optional_args,
+    make_completion,
+    refresh=False,
+    usage=None,
+):
+    """
+    Return an iterator over the response: the cached one if there is one (and
+    refresh isn't set), otherwise the stream from make_completion(), which is
+    cached once it has completed. A cache hit is noted in usage, if given.
+    """
+    key = cache_key(model_name, provider, history, optional_args)
+    if not refresh:
+        response = get(key)
+        if response is not None:
+            if usage is not None:
+                usage["cached"] = True
+            return _replay(response)
+    return _put_when_complete(make_completion(), key, model_name)
@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+import ask_daemon
+import failover
+import message_history
+import model_handling
+import providers
+
+
+@pytest.fixture
+def sent(monkeypatch, tmp_path):
+    """
+    Run the daemon against a fake provider under a fresh home directory, and
+    return the list of message lists it was sent.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    sent = []
+
+    def stream_response(
+        client, provider, model_name, history, optional_args, usage=None
+    ):
+        sent.append(
+            [(line.role, line.content) for line in history.get_message_history()]
+        )
+        yield "ok"
+
+    monkeypatch.setattr(providers, "get_client", lambda provider, model_name: object())
+    monkeypatch.setattr(providers, "stream_response", stream_response)
+    return sent
+
+
+def ask(daemon, user_prompt, reply_mode=True, private=False):
+    wfile = io.BytesIO()
+    daemon.handle(
+        {
+            "user_prompt": user_prompt,
+            "attachments": [],
+            "reply_mode": reply_mode,
+            "conv_id": None,
+            "from_turn": None,
+            "system_prompt": "Be brief.",
+            "model_name": model_handling.DEFAULT_MODEL_NAME,
+            "optional_args": {},
+            "private": private,
+            "cache": False,
+            "refresh": False,
+            "context_strategy": "drop_oldest",
+            "max_context": None,
+            "retries": failover.DEFAULT_RETRIES,
+            "fallback_model_name": None,
+            "hedge_after": None,
+        },
+        wfile,
+    )
+    return wfile.getvalue().decode()
+
+
+def test_private_prompt_is_not_sent_with_later_replies(sent):
+    daemon = ask_daemon.AskDaemon()
+    ask(daemon, "first", reply_mode=False)
+    ask(daemon, "SECRET", private=True)
+    ask(daemon, "public")
+
+    prompts = [content for role, content in sent[-1] if role == "user"]
+    assert prompts == ["first", "public"]
+
+
+def test_failed_prompt_is_not_sent_with_later_replies(sent, monkeypatch):
+    daemon = ask_daemon.AskDaemon()
+    ask(daemon, "first", reply_mode=False)
+
+    def fail(*args, **kwargs):
+        raise ValueError("bad request")
+        yield
+
+    with monkeypatch.context() as m:
+        m.setattr(providers, "stream_response", fail)
+        assert '"error"' in ask(daemon, "FAILED")
+    ask(daemon, "public")
+
+    prompts = [content for role, content in sent[-1] if role == "user"]
+    assert prompts == ["first", "public"]
+
+
+def test_turns_saved_by_other_processes_are_sent(sent):
+    daemon = ask_daemon.AskDaemon()
+    ask(daemon, "first", reply_mode=False)
+    # Leaves the conversation cached, since nothing is saved
+    ask(daemon, "peek", private=True)
+
+    # As another `ask` would, with its own connection to the same database
+    other = message_history.HistoryStore()
+    other.update_history(0, "elsewhere", "ok", model_handling.DEFAULT_MODEL_NAME)
+    other.close()
+    ask(daemon, "third")
+
+    prompts = [content for role, content in sent[-1] if role == "user"]
+    assert prompts == ["first", "elsewhere", "third"]
@@ -0,0 +1,72 @@
+import httpx
+import pytest
+
+import failover
+
+REQUEST = httpx.Request("POST", "https://generativelanguage.googleapis.com/")
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        httpx.ConnectError("Connection refused", request=REQUEST),
+        httpx.RemoteProtocolError("Server disconnected", request=REQUEST),
+        httpx.ReadTimeout("Timed out", request=REQUEST),
+    ],
+)
+def test_raw_httpx_errors_are_retryable(error):
+    assert failover.is_retryable(error)
+
+
+def test_dropped_connection_is_retried(monkeypatch):
+    monkeypatch.setattr(failover, "backoff_delay", lambda retry: 0)
+    calls = []
+
+    def make_completion(model_name, usage):
+        calls.append(model_name)
+        if len(calls) == 1:
+            raise httpx.RemoteProtocolError("Server disconnected", request=REQUEST)
+        yield "ok"
+
+    usage = {}
+    completion = failover.resilient_completion(make_completion, "gemini", usage)
+    assert "".join(completion) == "ok"
+    assert len(calls) == 2
+    assert len(usage["attempts"]) == 2
+
+
+def test_fallback_answers_once_retries_fail(monkeypatch):
+    monkeypatch.setattr(failover, "backoff_delay", lambda retry: 0)
+    calls = []
+
+    def make_completion(model_name, usage):
+        calls.append(model_name)
+        if model_name == "gemini":
+            raise httpx.ConnectError("Connection refused", request=REQUEST)
+        yield "ok"
+
+    usage = {}
+    completion = failover.resilient_completion(
+        make_completion, "gemini", usage, retries=1, fallback_model_name="claude"
+    )
+    assert "".join(completion) == "ok"
+    assert calls == ["gemini", "gemini", "claude"]
+    assert usage["model"] == "claude"
+
+
+def test_no_fallback_once_text_has_arrived():
+    calls = []
+
+    def make_completion(model_name, usage):
+        calls.append(model_name)
+        yield "partial"
+        raise httpx.RemoteProtocolError("Server disconnected", request=REQUEST)
+
+    usage = {}
+    completion = failover.resilient_completion(
+        make_completion, "gemini", usage, fallback_model_name="claude"
+    )
+    with pytest.raises(httpx.RemoteProtocolError):
+        list(completion)
+    assert calls == ["gemini"]
+    assert usage["model"] == "gemini"
@@ -0,0 +1,114 @@
+import pickle
+import threading
+
+import message_history
+
+SYSTEM_PROMPT = "Be brief."
+
+
+def make_history(turns, chat_name=None):
+    history = message_history.History(chat_name, SYSTEM_PROMPT, legacy=False)
+    for turn in range(turns):
+        history.append_user_message(f"prompt {turn}")
+        history.append_response(f"response {turn}", "gpt-4o")
+    return history
+
+
+def contents(history):
+    return [(line.role, line.content) for line in history.get_message_history()]
+
+
+def test_concurrent_writers_lose_no_turns(tmp_path):
+    store = message_history.HistoryStore(pathname=str(tmp_path))
+    store.append_history(make_history(0))
+    store.close()
+    writers = 4
+    turns = 10
+    barrier = threading.Barrier(writers)
+    errors = []
+
+    def write(writer):
+        # Its own connection, as a separate `ask` would have
+        store = message_history.HistoryStore(pathname=str(tmp_path))
+        barrier.wait()
+        try:
+            for turn in range(turns):
+                if turn % 2:
+                    store.append_history(make_history(1))
+                else:
+                    store.update_history(0, f"{writer}/{turn}", "ok", "gpt-4o")
+                    store.flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            store.close()
+
+    threads = [
+        threading.Thread(target=write, args=(writer,)) for writer in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    store = message_history.HistoryStore(pathname=str(tmp_path))
+    assert store.get_chat_names() == [
+        str(conv_id) for conv_id in range(1 + writers * turns // 2)
+    ]
+    prompts = [
+        line.content
+        for line in store.get_history(0).get_message_history()
+        if line.role == "user"
+    ]
+    assert sorted(prompts) == sorted(
+        f"{writer}/{turn}" for writer in range(writers) for turn in range(0, turns, 2)
+    )
+    store.close()
+
+
+def test_pickle_is_migrated(tmp_path):
+    histories = [make_history(1, "0"), make_history(2, "1")]
+    with open(tmp_path / message_history.FILENAME_MESSAGE_HISTORY, "wb") as f:
+        pickle.dump({"chat_names": ["0", "1"], "history_list": histories}, f)
+
+    store = message_history.HistoryStore(pathname=str(tmp_path))
+    assert store.get_chat_names() == ["0", "1"]
+    for conv_id, history in enumerate(histories):
+        assert contents(store.get_history(conv_id)) == contents(history)
+    store.close()
+    assert not (tmp_path / message_history.FILENAME_MESSAGE_HISTORY).exists()
+    assert (tmp_path / "message_history.pkl.migrated").exists()
+
+    # Imported once only
+    store = message_history.HistoryStore(pathname=str(tmp_path))
+    assert store.get_chat_names() == ["0", "1"]
+    store.close()
+
+
+def test_branches_are_found_both_ways(tmp_path):
+    store = message_history.HistoryStore(pathname=str(tmp_path))
+    parent = store.append_history(make_history(3))
+    history = make_history(3)
+    branch = store.branch(parent, history.turn_boundary(1))
+    branch.append_user_message("another prompt")
+    branch.append_response("another response", "gpt-4o")
+    child = store.append_history(branch)
+    nested = store.branch(child, branch.turn_boundary(2))
+    nested.append_user_message("yet another prompt")
+    nested.append_response("yet another response", "gpt-4o")
+    grandchild = store.append_history(nested)
+
+    assert store.get_fork(parent) is None
+    assert store.get_fork(child) == (parent, 1)
+    assert store.get_fork(grandchild) == (child, 2)
+    assert store.get_branches(parent) == [(child, 1)]
+    assert store.get_branches(child) == [(grandchild, 2)]
+    assert store.get_forks() == {child: (parent, 1), grandchild: (child, 2)}
+    assert contents(store.get_history(grandchild)) == contents(make_history(1)) + [
+        ("user", "another prompt"),
+        ("assistant", "another response"),
+        ("user", "yet another prompt"),
+        ("assistant", "yet another response"),
+    ]
+    store.close()
@@ -0,0 +1,38 @@
+import message_history
+import model_handling
+import providers
+import token_budget
+
+
+def test_turns_are_dropped_if_summarizing_fails(monkeypatch):
+    requested = []
+
+    def stream_response(
+        client, provider, model_name, history, optional_args, usage=None
+    ):
+        requested.append(model_name)
+        raise ValueError("invalid request")
+        yield
+
+    monkeypatch.setattr(providers, "get_client", lambda provider, model_name: object())
+    monkeypatch.setattr(providers, "stream_response", stream_response)
+    history = message_history.History(None, "Be brief.", legacy=False)
+    for turn in range(token_budget.DROP_STEP_MESSAGES):
+        history.append_user_message(f"prompt {turn} " * 100)
+        history.append_response(
+            f"response {turn} " * 100, model_handling.DEFAULT_MODEL_NAME
+        )
+    history.append_user_message("last prompt")
+
+    sent = token_budget.fit_to_context(
+        history, model_handling.DEFAULT_MODEL_NAME, "summarize", max_tokens=500
+    )
+    assert (
+        sent.get_message_history()
+        == token_budget.fit_to_context(
+            history, model_handling.DEFAULT_MODEL_NAME, "drop_oldest", max_tokens=500
+        ).get_message_history()
+    )
+    assert requested == [model_handling.DEFAULT_MODEL_NAME]
+    assert sent.get_message_history()[0].content == "Be brief."
+    assert sent.get_message_history()[-1].content == "last prompt"
@@ -0,0 +1,105 @@
+import sys
+
+import failover
+import message_history
+import providers
+from model_handling import (
+    MAX_OUTPUT_TOKENS,
+    get_context_limit,
+    model_name_to_provider,
+)
+
+# This provides fitting a conversation into the model's context window before it
+# is sent. The saved history is never changed; only what is sent is trimmed.
+
+CONTEXT_STRATEGIES = ["drop_oldest", "summarize", "none"]
+
+# Turns are dropped in steps of this many messages, counted from the start of the
+# conversation. That way the first message sent stays the same for several turns,
+# and so does the prefix that provider prompt caches match on.
+DROP_STEP_MESSAGES = 8
+
+SUMMARY_SYSTEM_PROMPT = "You summarize conversations. Keep every fact, decision, piece of code and open question that later turns might refer to. Be concise."
+
+
+def fit_to_context(history, model_name, strategy="drop_oldest", max_tokens=None):
+    """
+    Return history as it should be sent to model_name: unchanged if it fits into
+    max_tokens (default: the context window minus room for the response),
+    otherwise with the oldest turns dropped ("drop_oldest") or replaced by a
+    summary added to the system prompt ("summarize"). The system prompt and the
+    latest message are always kept.
+    """
+    if strategy == "none":
+        return history
+    budget = (
+        max_tokens
+        if max_tokens is not None
+        else get_context_limit(model_name) - MAX_OUTPUT_TOKENS
+    )
+
+    messages = history.get_message_history()
+    total = sum(history.get_token_count(line) for line in messages)
+    if total <= budget:
+        return history
+
+    system = messages[:1] if messages and messages[0].role == "system" else []
+    rest = messages[len(system) :]
+    start = 0
+    while start < len(rest) - 1 and total > budget:
+        total -= history.get_token_count(rest[start])
+        start += 1
+    start = min(-(-start // DROP_STEP_MESSAGES) * DROP_STEP_MESSAGES, len(rest) - 1)
+    # Providers expect the conversation to start with a user turn
+    while start < len(rest) - 1 and rest[start].role != "user":
+        start += 1
+    dropped, kept = rest[:start], rest[start:]
+
+    if strategy == "summarize" and dropped and not history.is_legacy():
+        try:
+            summary = summarize(dropped, model_name, budget)
+        except Exception as e:
+            # The turns are left out as with "drop_oldest" instead
+            print(
+                f"(couldn't summarize the earlier turns, so they aren't sent: {type(e).__name__}: {e})",
+                file=sys.stderr,
+            )
+            return history.with_message_history(system + kept)
+        system_prompt = system[0].content + "\n\n" if system else ""
+        system = [
+            message_history.Message(
+                "system",
+                f"{system_prompt}Summary of the earlier part of this conversation:\n{summary}",
+            )
+        ]
+
+    return history.with_message_history(system + kept)
+
+
+def summarize(messages, model_name, max_tokens):
+    """
+    Ask model_name for a summary of messages (the most recent max_tokens' worth of
+    them, if they don't all fit). The request is retried as in failover.py.
+    """
+    transcript = "\n\n".join(
+        f"{line.model_name or line.role}: {message_history.message_text(line)}"
+        for line in messages
+    )
+    # ~4 characters per token, as in estimate_token_count
+    transcript = transcript[-4 * max_tokens :]
+
+    summary_history = message_history.History(None, SUMMARY_SYSTEM_PROMPT, legacy=False)
+    summary_history.append_user_message(transcript)
+
+    def make_completion(attempt_model_name, attempt_usage):
+        provider = model_name_to_provider(attempt_model_name)
+        return providers.stream_response(
+            providers.get_client(provider, attempt_model_name),
+            provider,
+            attempt_model_name,
+            summary_history,
+            {},
+            attempt_usage,
+        )
+
+    return "".join(failover.resilient_completion(make_completion, model_name, {}))